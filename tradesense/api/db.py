@@ -1,58 +1,266 @@
 import os
 import asyncio
-from libsql_client import create_client
+import concurrent.futures
+import threading
+import time
+from contextlib import contextmanager
+from libsql_client import create_client, LibsqlError
+
+# Connection settings
+# A single long-lived client is owned by a background event-loop thread per
+# worker process, so a request no longer pays for a new loop, TLS handshake
+# and auth on every statement.
+_MAX_IN_FLIGHT = int(os.environ.get('TURSO_MAX_IN_FLIGHT', '16'))
+_QUERY_TIMEOUT_SECONDS = float(os.environ.get('TURSO_QUERY_TIMEOUT', '15'))
+_HEALTH_CHECK_INTERVAL_SECONDS = 30
 
 # Initialize Turso client
-def get_db_client():
-    """Get Turso database client"""
+def _get_db_config():
     url = os.environ.get('TURSO_DATABASE_URL')
     auth_token = os.environ.get('TURSO_AUTH_TOKEN')
-    
-    if not url or not auth_token:
+
+    # Local libSQL files (file:...) do not need a token
+    if not url or (not auth_token and not url.startswith('file:')):
         raise ValueError("TURSO_DATABASE_URL and TURSO_AUTH_TOKEN must be set")
-    
+
+    return url, auth_token
+
+def get_db_client():
+    """Get Turso database client"""
+    url, auth_token = _get_db_config()
+
     return create_client(
         url=url,
         auth_token=auth_token
     )
 
-# Global client instance
-db = None
 
-# Internal helper for async execution
-async def _async_execute(query, params=None):
-    url = os.environ.get('TURSO_DATABASE_URL')
-    auth_token = os.environ.get('TURSO_AUTH_TOKEN')
-    
-    if not url or not auth_token:
-        raise ValueError("TURSO_DATABASE_URL and TURSO_AUTH_TOKEN must be set")
-        
-    async with create_client(url=url, auth_token=auth_token) as client:
-        return await client.execute(query, params or [])
+class _ClientManager:
+    """
+    Owns the event loop thread and the shared libSQL client of this process.
+
+    Statements from any request thread are scheduled on the loop with
+    run_coroutine_threadsafe and limited by a semaphore, so at most
+    _MAX_IN_FLIGHT statements are outstanding against Turso at once.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pid = None
+        self._loop = None
+        self._thread = None
+        self._client = None
+        self._semaphore = None
+        self._last_ok = 0.0
+
+    def _ensure_loop(self):
+        # A forked worker (gunicorn --preload) inherits a dead loop thread,
+        # so the loop is keyed on the pid as well.
+        if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+            return self._loop
+
+        with self._lock:
+            if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+                return self._loop
+
+            loop = asyncio.new_event_loop()
+            thread = threading.Thread(target=loop.run_forever, name='turso-client', daemon=True)
+            thread.start()
+
+            self._loop = loop
+            self._thread = thread
+            self._client = None
+            self._semaphore = None
+            self._last_ok = 0.0
+            self._pid = os.getpid()
+            return loop
+
+    async def _get_client(self):
+        if self._client is None or self._client.closed:
+            self._client = get_db_client()
+            self._last_ok = 0.0
+        return self._client
+
+    async def _reset_client(self):
+        client, self._client = self._client, None
+        if client is not None and not client.closed:
+            try:
+                await client.close()
+            except Exception as e:
+                print(f"Error closing Turso client: {str(e)}")
+
+    async def _healthy_client(self):
+        client = await self._get_client()
+        if time.monotonic() - self._last_ok < _HEALTH_CHECK_INTERVAL_SECONDS:
+            return client
+
+        # Idle connections may have been dropped by Turso or a proxy;
+        # probe before use and reconnect once if the probe fails.
+        try:
+            await client.execute('SELECT 1')
+        except Exception as e:
+            print(f"Turso health check failed, reconnecting: {str(e)}")
+            await self._reset_client()
+            client = await self._get_client()
+            await client.execute('SELECT 1')
+
+        self._last_ok = time.monotonic()
+        return client
+
+    async def _run(self, operation):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(_MAX_IN_FLIGHT)
+
+        async with self._semaphore:
+            client = await self._healthy_client()
+            try:
+                result = await operation(client)
+            except LibsqlError:
+                # SQL errors leave the connection usable
+                raise
+            except Exception:
+                # Transport failure: drop the client so the next call reconnects.
+                # The statement itself is not retried because it may have been applied.
+                await self._reset_client()
+                raise
+
+            self._last_ok = time.monotonic()
+            return result
+
+    def run(self, operation):
+        """Run operation(client) on the shared client and wait for its result"""
+        loop = self._ensure_loop()
+        future = asyncio.run_coroutine_threadsafe(self._run(operation), loop)
+        try:
+            return future.result(timeout=_QUERY_TIMEOUT_SECONDS)
+        except concurrent.futures.TimeoutError:
+            # Cancels the coroutine too, so it frees its pool slot and cannot
+            # commit after the caller was told the query failed
+            future.cancel()
+            raise
+
+    def close(self):
+        """Close the shared client and stop the loop thread"""
+        with self._lock:
+            if self._pid != os.getpid() or self._loop is None:
+                return
+            loop, thread = self._loop, self._thread
+
+            if self._client is not None:
+                try:
+                    asyncio.run_coroutine_threadsafe(self._reset_client(), loop).result(timeout=5)
+                except Exception as e:
+                    print(f"Error closing Turso client: {str(e)}")
+
+            loop.call_soon_threadsafe(loop.stop)
+            thread.join(timeout=5)
+            self._loop = None
+            self._thread = None
+            self._pid = None
+
+
+_manager = _ClientManager()
+
+def close_db():
+    """Close the pooled database client of this process"""
+    _manager.close()
 
 def execute_query(query, params=None):
     """Execute a query and return results"""
-    return asyncio.run(_async_execute(query, params))
+    return _manager.run(lambda client: client.execute(query, params or []))
+
+def _row_to_dict(result, row):
+    # Convert Row to dict using zip
+    return dict(zip(result.columns, row))
 
 def execute_many(query, params_list):
-    """Execute multiple queries in a batch"""
-    results = []
-    for params in params_list:
-        results.append(execute_query(query, params))
-    return results
+    """
+    Execute one query for every parameter set as a single atomic batch.
+
+    The whole set is sent to Turso in one round trip; if any statement fails
+    none of them are applied.
+    """
+    params_list = list(params_list)
+    if not params_list:
+        return []
+    statements = [(query, params or []) for params in params_list]
+    return _manager.run(lambda client: client.batch(statements))
+
+def execute_batch(statements):
+    """
+    Execute a list of (query, params) pairs as a single atomic batch.
+
+    Unlike execute_many the statements may differ. Returns one result
+    per statement, in order.
+    """
+    statements = [(query, params or []) for query, params in statements]
+    if not statements:
+        return []
+    return _manager.run(lambda client: client.batch(statements))
 
 def fetch_one(query, params=None):
     """Fetch a single row as a dictionary"""
     result = execute_query(query, params)
     if not result.rows:
         return None
-    
-    # Convert Row to dict using zip
-    return dict(zip(result.columns, result.rows[0]))
+
+    return _row_to_dict(result, result.rows[0])
 
 def fetch_all(query, params=None):
     """Fetch all rows as a list of dictionaries"""
     result = execute_query(query, params)
-    
+
     # Convert all Rows to dicts
-    return [dict(zip(result.columns, row)) for row in result.rows]
+    return [_row_to_dict(result, row) for row in result.rows]
+
+
+class Transaction:
+    """
+    Interactive transaction on the shared client, see transaction().
+
+    Statements run one round trip each, so prefer execute_batch when the
+    statements do not depend on each other's results.
+    """
+
+    def __init__(self, tx):
+        self._tx = tx
+
+    def execute(self, query, params=None):
+        return _manager.run(lambda client: self._tx.execute(query, params or []))
+
+    def fetch_one(self, query, params=None):
+        result = self.execute(query, params)
+        if not result.rows:
+            return None
+        return _row_to_dict(result, result.rows[0])
+
+    def fetch_all(self, query, params=None):
+        result = self.execute(query, params)
+        return [_row_to_dict(result, row) for row in result.rows]
+
+
+@contextmanager
+def transaction():
+    """
+    Group mixed statements into one all-or-nothing transaction.
+
+        with transaction() as tx:
+            tx.execute('UPDATE ...', [...])
+            row = tx.fetch_one('SELECT ...', [...])
+
+    Commits when the block exits normally and rolls back on any exception.
+    """
+    async def begin(client):
+        return client.transaction()
+
+    tx = _manager.run(begin)
+    try:
+        yield Transaction(tx)
+    except BaseException:
+        try:
+            _manager.run(lambda client: tx.rollback())
+        except Exception as e:
+            print(f"Rollback failed: {str(e)}")
+        raise
+    else:
+        _manager.run(lambda client: tx.commit())
@@ -0,0 +1,36 @@
+import hashlib
+from functools import wraps
+
+from flask import request, make_response
+
+
+def http_cached(max_age=0, s_maxage=60, stale_while_revalidate=300, no_store_if=None):
+    """
+    Decorator for public GET endpoints: adds a strong ETag (sha256 of the
+    body) and Cache-Control for browsers (max_age) and the CDN (s_maxage,
+    stale_while_revalidate), and answers a matching If-None-Match with 304.
+
+    Only 200 responses are marked cacheable; errors pass through unchanged.
+    no_store_if(payload) is called with the JSON body; when it is true the
+    response gets Cache-Control: no-store and no ETag instead (e.g. made-up
+    fallback data that must not be cached by the CDN).
+    """
+    def wrapper(fn):
+        @wraps(fn)
+        def decorator(*args, **kwargs):
+            response = make_response(fn(*args, **kwargs))
+            if response.status_code != 200 or response.is_streamed:
+                return response
+            if no_store_if is not None and no_store_if(response.get_json(silent=True)):
+                response.headers['Cache-Control'] = 'no-store'
+                return response
+
+            response.set_etag(hashlib.sha256(response.get_data()).hexdigest())
+            response.headers['Cache-Control'] = (
+                f'public, max-age={max_age}, s-maxage={s_maxage}, '
+                f'stale-while-revalidate={stale_while_revalidate}'
+            )
+            # Turns the response into an empty 304 when the client's ETag matches
+            return response.make_conditional(request)
+        return decorator
+    return wrapper
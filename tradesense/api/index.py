@@ -33,7 +33,7 @@ CORS(app)
 JWTManager(app)
 
 # Initialize database connection
-# Database initialization is handled per-request in db.py for better serverless performance
+# db.py keeps one pooled Turso client per worker process, opened lazily on the first query
 # from db import init_db
 # init_db()
 
@@ -46,6 +46,7 @@ try:
     from routes.admin import admin_bp
     from routes.leaderboard import leaderboard_bp
     from routes.checkout import checkout_bp
+    from routes.cron import cron_bp
 except ImportError:
     # Fallback for some Vercel environments
     from .routes.auth import auth_bp
@@ -55,6 +56,7 @@ except ImportError:
     from .routes.admin import admin_bp
     from .routes.leaderboard import leaderboard_bp
     from .routes.checkout import checkout_bp
+    from .routes.cron import cron_bp
 
 app.register_blueprint(auth_bp, url_prefix='/api/auth')
 app.register_blueprint(market_bp, url_prefix='/api/market')
@@ -63,6 +65,7 @@ app.register_blueprint(challenges_bp, url_prefix='/api/challenges')
 app.register_blueprint(admin_bp, url_prefix='/api/admin')
 app.register_blueprint(leaderboard_bp, url_prefix='/api/leaderboard')
 app.register_blueprint(checkout_bp, url_prefix='/api/checkout')
+app.register_blueprint(cron_bp, url_prefix='/api/cron')
 
 @app.route('/api/health', methods=['GET'])
 @app.route('/health', methods=['GET'])
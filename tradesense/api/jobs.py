@@ -0,0 +1,70 @@
+"""
+Maintenance jobs, run from the api directory:
+
+    python jobs.py rebuild-leaderboard
+    python jobs.py mark-to-market
+    python jobs.py sweep-rules
+    python jobs.py rollover [--date YYYY-MM-DD]
+"""
+import argparse
+from datetime import date
+from dotenv import load_dotenv
+
+# Load environment variables from parent directory
+load_dotenv('../.env.local')
+
+from db import close_db
+from services.daily_metrics import rollover
+from services.drawdown import drawdowns
+from services.leaderboard import rebuild_leaderboard
+from services.positions import mark_to_market
+from services.rule_sweeper import sweep_rules
+
+
+def cmd_rebuild_leaderboard(args):
+    rows = rebuild_leaderboard()
+    print(f"✓ Leaderboard rebuilt: {rows} rows")
+
+
+def cmd_mark_to_market(args):
+    from routes.market import mark_prices
+
+    summary = mark_to_market(mark_prices)
+    drawdowns.flush()
+    print(f"✓ Marked {summary['positions']} positions ({summary['priced']}/{summary['symbols']} symbols priced): "
+          f"{summary['challenges']} challenges updated, {summary['status_changes']} status changes")
+
+
+def cmd_sweep_rules(args):
+    summary = sweep_rules()
+    print(f"✓ Checked {summary['checked']} active challenges: {summary['failed']} failed, "
+          f"{summary['passed']} passed, {summary['skipped']} changed meanwhile")
+
+
+def cmd_rollover(args):
+    summary = rollover(args.date)
+    print(f"✓ Daily metrics rolled over: {summary['closed']} rows closed, {summary['opened']} opened")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='TradeSense maintenance jobs')
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('rebuild-leaderboard', help='Recompute the monthly leaderboard from challenges') \
+        .set_defaults(func=cmd_rebuild_leaderboard)
+    commands.add_parser('mark-to-market', help='Revalue open positions at the latest prices') \
+        .set_defaults(func=cmd_mark_to_market)
+    commands.add_parser('sweep-rules', help='Check the rules of every active challenge') \
+        .set_defaults(func=cmd_sweep_rules)
+    rollover_parser = commands.add_parser('rollover', help="Close earlier days' daily metrics and open today's")
+    rollover_parser.add_argument('--date', type=date.fromisoformat, help='Day to open (default: today, UTC)')
+    rollover_parser.set_defaults(func=cmd_rollover)
+
+    args = parser.parse_args()
+    try:
+        args.func(args)
+    finally:
+        close_db()
+
+
+if __name__ == '__main__':
+    main()
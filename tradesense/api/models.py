@@ -83,7 +83,7 @@ class Challenge:
                  current_equity: float, status: str = 'active', failure_reason: str = None,
                  max_daily_loss_pct: float = 5.00, max_total_loss_pct: float = 10.00,
                  profit_target_pct: float = 10.00, created_at: str = None,
-                 passed_at: str = None, failed_at: str = None):
+                 passed_at: str = None, failed_at: str = None, version: int = 0):
         self.id = id
         self.user_id = user_id
         self.plan_id = plan_id
@@ -97,6 +97,7 @@ class Challenge:
         self.created_at = created_at or datetime.utcnow().isoformat()
         self.passed_at = passed_at
         self.failed_at = failed_at
+        self.version = version
     
     @staticmethod
     def from_row(row):
@@ -116,7 +117,8 @@ class Challenge:
             profit_target_pct=float(row.get('profit_target_pct', 10.00)),
             created_at=row.get('created_at'),
             passed_at=row.get('passed_at'),
-            failed_at=row.get('failed_at')
+            failed_at=row.get('failed_at'),
+            version=int(row.get('version') or 0)
         )
     
     def to_dict(self, include_trades=False):
@@ -0,0 +1,88 @@
+import base64
+import json
+
+from flask import Response, stream_with_context
+
+# Keyset pagination helpers. A page query returns rows ordered by a unique
+# key, descending, starting strictly after the key in the cursor, so every
+# page is an index range scan however deep the client has paged.
+
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 1000
+# Rows fetched per round trip when streaming NDJSON
+STREAM_CHUNK = 500
+
+
+def encode_cursor(*values):
+    """Opaque cursor for the key of the last row of a page"""
+    raw = json.dumps(values, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Key values from a cursor; raises ValueError on anything malformed"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        values = json.loads(raw)
+    except (ValueError, TypeError) as e:
+        raise ValueError('Invalid cursor') from e
+    if not isinstance(values, list):
+        raise ValueError('Invalid cursor')
+    return values
+
+
+def page_args(args, key_size, default_limit=DEFAULT_LIMIT):
+    """(limit, after) from ?limit=&cursor=; raises ValueError with a client message"""
+    try:
+        limit = int(args.get('limit', default_limit))
+    except ValueError:
+        raise ValueError('limit must be an integer')
+    if not 1 <= limit <= MAX_LIMIT:
+        raise ValueError(f'limit must be between 1 and {MAX_LIMIT}')
+    cursor = args.get('cursor')
+    if not cursor:
+        return limit, None
+    after = decode_cursor(cursor)
+    if len(after) != key_size:
+        raise ValueError('Invalid cursor')
+    return limit, after
+
+
+def keyset_page(fetch, after, limit, key):
+    """
+    One page: fetch(after, n) must return up to n rows after the key `after`
+    (None for the first page); key(row) gives a row's key values.
+    Returns (rows, next_cursor), next_cursor None on the last page.
+    """
+    rows = fetch(after, limit + 1)
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor(*key(rows[-1]))
+
+
+def iter_keyset(fetch, after=None, key=None, limit=None, chunk_size=STREAM_CHUNK):
+    """
+    Yield successive lists of up to chunk_size rows after `after` (at most
+    limit rows in total), one query per list, so memory stays flat however
+    many rows there are.
+    """
+    sent = 0
+    while limit is None or sent < limit:
+        size = chunk_size if limit is None else min(chunk_size, limit - sent)
+        batch = fetch(after, size)
+        if batch:
+            yield batch
+        sent += len(batch)
+        if len(batch) < size:
+            return
+        after = key(batch[-1])
+
+
+def ndjson_response(fetch, after, key, serialize, limit=None):
+    """Stream every row after `after` (at most limit) as newline-delimited JSON"""
+    def rows():
+        for batch in iter_keyset(fetch, after, key, limit):
+            yield ''.join(json.dumps(serialize(row)) + '\n' for row in batch)
+
+    return Response(stream_with_context(rows()), mimetype='application/x-ndjson')
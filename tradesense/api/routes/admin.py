@@ -1,7 +1,10 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, Response, stream_with_context
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from db import execute_query, fetch_one, fetch_all
+from db import execute_query, execute_batch, fetch_one, fetch_all
+import json
 from datetime import datetime
+from pagination import page_args, keyset_page, iter_keyset
+from services.export import csv_stream, parquet_stream, parquet_available
 
 admin_bp = Blueprint('admin', __name__)
 
@@ -20,24 +23,266 @@ def admin_required():
         return decorator
     return wrapper
 
+# Columns the admin list may project with ?fields=, and how to serialize them
+_CHALLENGE_FIELDS = {
+    'id': int,
+    'user_id': int,
+    'plan_id': int,
+    'start_balance': float,
+    'current_equity': float,
+    'status': str,
+    'failure_reason': str,
+    'max_daily_loss_pct': float,
+    'max_total_loss_pct': float,
+    'profit_target_pct': float,
+    'created_at': str,
+    'passed_at': str,
+    'failed_at': str,
+}
+_DEFAULT_CHALLENGE_FIELDS = ['id', 'user_id', 'plan_id', 'start_balance', 'current_equity', 'status', 'created_at']
+
+_CHALLENGE_FILTERS = ('status', 'plan', 'user_id', 'created_from', 'created_to')
+
+def challenge_filters(args):
+    """
+    WHERE clause and params (on alias c) for ?status=&plan=&user_id=&created_from=&created_to=.
+    status takes a comma-separated list, plan an id or a slug, the dates
+    are ISO dates or datetimes (created_to is exclusive). Raises ValueError.
+    """
+    clauses, params = [], []
+    statuses = [s for s in args.get('status', '').split(',') if s]
+    if statuses:
+        if any(s not in ('active', 'passed', 'failed') for s in statuses):
+            raise ValueError('Invalid status')
+        clauses.append(f"c.status IN ({','.join('?' * len(statuses))})")
+        params.extend(statuses)
+    plan = args.get('plan')
+    if plan:
+        if plan.isdigit():
+            clauses.append('c.plan_id = ?')
+            params.append(int(plan))
+        else:
+            clauses.append('c.plan_id = (SELECT id FROM plans WHERE slug = ?)')
+            params.append(plan)
+    user_id = args.get('user_id')
+    if user_id:
+        if not user_id.isdigit():
+            raise ValueError('user_id must be an integer')
+        clauses.append('c.user_id = ?')
+        params.append(int(user_id))
+    for name, op in (('created_from', '>='), ('created_to', '<')):
+        value = args.get(name)
+        if value:
+            try:
+                # Stored as 'YYYY-MM-DD HH:MM:SS' (UTC), so compare in that form
+                value = datetime.fromisoformat(value).strftime('%Y-%m-%d %H:%M:%S')
+            except ValueError:
+                raise ValueError(f'{name} must be an ISO date')
+            clauses.append(f'c.created_at {op} ?')
+            params.append(value)
+    return (' AND '.join(clauses) or '1'), params
+
+def challenge_fields(args):
+    """Columns requested with ?fields=a,b (default: the admin table's columns)"""
+    fields = [f for f in args.get('fields', '').split(',') if f] or _DEFAULT_CHALLENGE_FIELDS
+    unknown = [f for f in fields if f not in _CHALLENGE_FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+    return fields
+
+def serialize_challenge(row, fields):
+    return {f: (None if row[f] is None else _CHALLENGE_FIELDS[f](row[f])) for f in fields}
+
+def fetch_challenges(where, params, fields, after, limit):
+    """Challenges matching where, newest first, after the (created_at, id) key"""
+    # The key columns are always selected so the next cursor can be built
+    columns = ', '.join(f'c.{f}' for f in dict.fromkeys(fields + ['created_at', 'id']))
+    keyset = ''
+    if after is not None:
+        keyset = 'AND (c.created_at, c.id) < (?, ?)'
+        params = params + list(after)
+    return fetch_all(
+        f'SELECT {columns} FROM challenges c WHERE {where} {keyset} '
+        'ORDER BY c.created_at DESC, c.id DESC LIMIT ?',
+        params + [limit]
+    )
+
+def challenge_key(row):
+    return row['created_at'], row['id']
+
 @admin_bp.route('/challenges', methods=['GET'])
 @admin_required()
 def get_all_challenges():
-    challenges = fetch_all('SELECT * FROM challenges ORDER BY created_at DESC', [])
-    
-    challenges_list = []
-    for c in challenges:
-        challenges_list.append({
-            'id': c['id'],
-            'user_id': c['user_id'],
-            'plan_id': c.get('plan_id'),
-            'start_balance': float(c.get('start_balance', 0)),
-            'current_equity': float(c.get('current_equity', 0)),
-            'status': c.get('status'),
-            'created_at': c.get('created_at')
-        })
+    """
+    Challenges newest first, one page at a time (?limit=, ?cursor=, see
+    pagination.py), filtered as in challenge_filters and projected to
+    ?fields=.
+    """
+    try:
+        where, params = challenge_filters(request.args)
+        fields = challenge_fields(request.args)
+        limit, after = page_args(request.args, key_size=2)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    challenges, next_cursor = keyset_page(
+        lambda after, n: fetch_challenges(where, params, fields, after, n),
+        after, limit, challenge_key
+    )
     
-    return jsonify({'challenges': challenges_list})
+    return jsonify({
+        'challenges': [serialize_challenge(c, fields) for c in challenges],
+        'next_cursor': next_cursor
+    })
+
+@admin_bp.route('/challenges/summary', methods=['GET'])
+@admin_required()
+def get_challenges_summary():
+    """Counts and equity totals per (status, plan), computed in SQL; same filters as the list"""
+    try:
+        where, params = challenge_filters(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    rows = fetch_all(
+        f"""
+        SELECT c.status, c.plan_id, p.slug AS plan,
+               COUNT(*) AS count,
+               SUM(c.start_balance) AS total_start_balance,
+               SUM(c.current_equity) AS total_equity,
+               AVG((c.current_equity - c.start_balance) * 100.0 / NULLIF(c.start_balance, 0)) AS avg_profit_pct
+        FROM challenges c
+        LEFT JOIN plans p ON p.id = c.plan_id
+        WHERE {where}
+        GROUP BY c.status, c.plan_id
+        ORDER BY c.status, c.plan_id
+        """,
+        params
+    )
+
+    groups = [{
+        'status': r['status'],
+        'plan_id': r['plan_id'],
+        'plan': r['plan'],
+        'count': r['count'],
+        'total_start_balance': float(r['total_start_balance'] or 0),
+        'total_equity': float(r['total_equity'] or 0),
+        'avg_profit_pct': float(r['avg_profit_pct'] or 0)
+    } for r in rows]
+
+    by_status = {}
+    for g in groups:
+        totals = by_status.setdefault(g['status'], {'count': 0, 'total_equity': 0.0})
+        totals['count'] += g['count']
+        totals['total_equity'] += g['total_equity']
+
+    return jsonify({
+        'groups': groups,
+        'by_status': by_status,
+        'total': {
+            'count': sum(g['count'] for g in groups),
+            'total_equity': sum(g['total_equity'] for g in groups)
+        }
+    })
+
+# Trade export columns (t = trades, c = challenges)
+_TRADE_EXPORT_COLUMNS = {
+    'id': ('t.id', int),
+    'challenge_id': ('t.challenge_id', int),
+    'user_id': ('c.user_id', int),
+    'symbol': ('t.symbol', str),
+    'side': ('t.side', str),
+    'quantity': ('t.quantity', int),
+    'price': ('t.price', float),
+    'total_value': ('t.total_value', float),
+    'profit_loss': ('t.profit_loss', float),
+    'executed_at': ('t.executed_at', str),
+}
+
+def fetch_export_trades(where, params, after, limit):
+    """Trades of the challenges matching where, newest first, after the (executed_at, id) key"""
+    columns = ', '.join(f'{expr} AS {name}' for name, (expr, _) in _TRADE_EXPORT_COLUMNS.items())
+    keyset = ''
+    if after is not None:
+        keyset = 'AND (t.executed_at, t.id) < (?, ?)'
+        params = params + list(after)
+    return fetch_all(
+        f'SELECT {columns} FROM trades t JOIN challenges c ON c.id = t.challenge_id '
+        f'WHERE {where} {keyset} ORDER BY t.executed_at DESC, t.id DESC LIMIT ?',
+        params + [limit]
+    )
+
+@admin_bp.route('/export/<table>', methods=['GET'])
+@admin_required()
+def export_table(table):
+    """
+    Stream challenges or trades as CSV (default) or Parquet (?format=parquet,
+    needs pyarrow), fetched in keyset chunks. Takes the admin list filters;
+    for trades they select the challenges whose trades are exported, and
+    challenge exports also accept ?fields=.
+    """
+    fmt = request.args.get('format', 'csv')
+    if table not in ('challenges', 'trades'):
+        return jsonify({'error': 'Unknown export'}), 404
+    if fmt not in ('csv', 'parquet'):
+        return jsonify({'error': 'format must be csv or parquet'}), 400
+    if fmt == 'parquet' and not parquet_available():
+        return jsonify({'error': 'Parquet export requires pyarrow'}), 501
+    try:
+        where, params = challenge_filters(request.args)
+        if table == 'challenges':
+            fields = challenge_fields(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    if table == 'challenges':
+        columns = {f: _CHALLENGE_FIELDS[f] for f in fields}
+        batches = iter_keyset(
+            lambda after, n: fetch_challenges(where, params, fields, after, n), key=challenge_key
+        )
+    else:
+        columns = {name: kind for name, (_, kind) in _TRADE_EXPORT_COLUMNS.items()}
+        batches = iter_keyset(
+            lambda after, n: fetch_export_trades(where, params, after, n),
+            key=lambda t: (t['executed_at'], t['id'])
+        )
+
+    filename = f"{table}-{datetime.utcnow().strftime('%Y%m%d-%H%M%S')}.{fmt}"
+    if fmt == 'csv':
+        body, mimetype = csv_stream(batches, list(columns)), 'text/csv'
+    else:
+        body, mimetype = parquet_stream(batches, columns), 'application/vnd.apache.parquet'
+    return Response(stream_with_context(body), mimetype=mimetype, headers={
+        'Content-Disposition': f'attachment; filename={filename}'
+    })
+
+# Upper bound on ids per bulk override request
+MAX_BULK_OVERRIDE = 10000
+
+def override_statuses(selection, params, new_status):
+    """
+    Set the status of every challenge whose id is returned by the
+    `selection` subquery, in one atomic batch: the previous statuses are
+    read and the set-based UPDATE applied in the same transaction.
+    Returns {id: previous_status} for the challenges that were updated.
+    """
+    before, updated = execute_batch([
+        (f'SELECT id, status FROM challenges WHERE id IN ({selection})', params),
+        (
+            f"""
+            UPDATE challenges
+            SET status = ?,
+                passed_at = CASE WHEN ? = 'passed' THEN datetime('now') ELSE passed_at END,
+                failed_at = CASE WHEN ? = 'failed' THEN datetime('now') ELSE failed_at END,
+                version = version + 1
+            WHERE id IN ({selection})
+            RETURNING id
+            """,
+            [new_status, new_status, new_status] + params
+        ),
+    ])
+    previous = {row['id']: row['status'] for row in before.rows}
+    return {row['id']: previous.get(row['id']) for row in updated.rows}
 
 @admin_bp.route('/challenges/<int:id>/override', methods=['PUT'])
 @admin_required()
@@ -48,28 +293,69 @@ def override_challenge(id):
     if new_status not in ['active', 'passed', 'failed']:
         return jsonify({'error': 'Invalid status'}), 400
         
-    challenge = fetch_one('SELECT * FROM challenges WHERE id = ?', [id])
-    if not challenge:
+    if not override_statuses('?', [id], new_status):
         return jsonify({'error': 'Challenge not found'}), 404
-    
-    if new_status == 'passed':
-        execute_query(
-            'UPDATE challenges SET status = ?, passed_at = datetime("now") WHERE id = ?',
-            [new_status, id]
-        )
-    elif new_status == 'failed':
-        execute_query(
-            'UPDATE challenges SET status = ?, failed_at = datetime("now") WHERE id = ?',
-            [new_status, id]
-        )
-    else:
-        execute_query(
-            'UPDATE challenges SET status = ? WHERE id = ?',
-            [new_status, id]
-        )
         
     return jsonify({'success': True, 'message': f'Challenge status updated to {new_status}'})
 
+@admin_bp.route('/challenges/override', methods=['PUT'])
+@admin_required()
+def bulk_override_challenges():
+    """
+    Set one status on many challenges at once, selected either by
+    {"ids": [...]} or by {"filter": {...}} with the admin list filters
+    (status, plan, user_id, created_from, created_to). Returns one result
+    per challenge.
+    """
+    data = request.get_json() or {}
+    new_status = data.get('status')
+    ids = data.get('ids')
+    filters = data.get('filter')
+
+    if new_status not in ['active', 'passed', 'failed']:
+        return jsonify({'error': 'Invalid status'}), 400
+    if (ids is None) == (filters is None):
+        return jsonify({'error': 'Provide either ids or filter'}), 400
+
+    if ids is not None:
+        if not isinstance(ids, list) or not all(isinstance(i, int) for i in ids):
+            return jsonify({'error': 'ids must be a list of integers'}), 400
+        if len(ids) > MAX_BULK_OVERRIDE:
+            return jsonify({'error': f'At most {MAX_BULK_OVERRIDE} ids per request'}), 400
+        ids = list(dict.fromkeys(ids))
+        updated = override_statuses('SELECT value FROM json_each(?)', [json.dumps(ids)], new_status)
+    else:
+        if not isinstance(filters, dict):
+            return jsonify({'error': 'filter must be an object'}), 400
+        # challenge_filters ignores other keys, so a misspelt one would
+        # leave the filter empty and match every challenge
+        unknown = [key for key in filters if key not in _CHALLENGE_FILTERS]
+        if unknown:
+            return jsonify({'error': f"Unknown filter keys: {', '.join(unknown)}"}), 400
+        try:
+            where, params = challenge_filters({k: str(v) for k, v in filters.items()})
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        if where == '1':
+            return jsonify({'error': 'filter must name at least one condition'}), 400
+        updated = override_statuses(f'SELECT c.id FROM challenges c WHERE {where}', params, new_status)
+        ids = sorted(updated)
+
+    results = []
+    for challenge_id in ids:
+        if challenge_id in updated:
+            results.append({'id': challenge_id, 'updated': True,
+                            'previous_status': updated[challenge_id], 'status': new_status})
+        else:
+            results.append({'id': challenge_id, 'updated': False, 'error': 'Challenge not found'})
+
+    return jsonify({
+        'success': True,
+        'status': new_status,
+        'updated': len(updated),
+        'results': results
+    })
+
 @admin_bp.route('/paypal-settings', methods=['GET', 'PUT'])
 @admin_required()
 def manage_paypal():
@@ -1,6 +1,9 @@
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from db import fetch_one, fetch_all
+from pagination import page_args, keyset_page
+from routes.trades import fetch_trades, trade_key, trade_to_dict
+from services.positions import challenge_positions
 
 challenges_bp = Blueprint('challenges', __name__)
 
@@ -60,7 +63,13 @@ def get_active_challenge():
 @challenges_bp.route('/<int:id>', methods=['GET'])
 @jwt_required()
 def get_challenge_detail(id):
+    """The challenge with its open positions and first page of trades (?limit=, ?cursor= as for GET /trades)"""
     user_id = get_jwt_identity()
+    try:
+        limit, after = page_args(request.args, key_size=2)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
     challenge = fetch_one('SELECT * FROM challenges WHERE id = ?', [id])
     
     if not challenge:
@@ -69,9 +78,8 @@ def get_challenge_detail(id):
     if str(challenge['user_id']) != str(user_id):
         return jsonify({'error': 'Unauthorized'}), 403
         
-    trades = fetch_all(
-        'SELECT * FROM trades WHERE challenge_id = ? ORDER BY executed_at DESC',
-        [id]
+    trades, next_cursor = keyset_page(
+        lambda after, n: fetch_trades(id, after, n), after, limit, trade_key
     )
     
     return jsonify({
@@ -84,14 +92,7 @@ def get_challenge_detail(id):
             'status': challenge.get('status'),
             'created_at': challenge.get('created_at')
         },
-        'trades': [{
-            'id': t['id'],
-            'symbol': t['symbol'],
-            'side': t['side'],
-            'quantity': t['quantity'],
-            'price': float(t.get('price', 0)),
-            'total_value': float(t.get('total_value', 0)),
-            'profit_loss': float(t.get('profit_loss', 0)),
-            'executed_at': t.get('executed_at')
-        } for t in trades]
+        'positions': challenge_positions(id),
+        'trades': [trade_to_dict(t) for t in trades],
+        'next_cursor': next_cursor
     })
@@ -1,6 +1,9 @@
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from db import execute_query, fetch_one
+from db import execute_batch, fetch_one
+from http_cache import http_cached
+from services.daily_metrics import OPEN_DAY
+from services.rules import plan_limits
 from datetime import datetime
 
 checkout_bp = Blueprint('checkout', __name__)
@@ -22,17 +25,23 @@ def mock_checkout():
     if not plan:
         return jsonify({'error': 'Invalid plan'}), 404
         
-    # Create challenge
-    execute_query(
-        'INSERT INTO challenges (user_id, plan_id, start_balance, current_equity, status, created_at) VALUES (?, ?, ?, ?, ?, datetime("now"))',
-        [user_id, plan['id'], plan['start_balance'], plan['start_balance'], 'active']
-    )
-    
-    # Get the created challenge
-    challenge = fetch_one(
-        'SELECT * FROM challenges WHERE user_id = ? ORDER BY id DESC LIMIT 1',
-        [user_id]
-    )
+    # Create challenge, with the plan's loss limits and profit target, and
+    # open its first day
+    daily_loss_pct, total_loss_pct, profit_target_pct = plan_limits(plan['id'])
+    created, _ = execute_batch([
+        (
+            'INSERT INTO challenges (user_id, plan_id, start_balance, current_equity, status, '
+            'max_daily_loss_pct, max_total_loss_pct, profit_target_pct, created_at) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?, datetime("now")) RETURNING id',
+            [user_id, plan['id'], plan['start_balance'], plan['start_balance'], 'active',
+             daily_loss_pct, total_loss_pct, profit_target_pct]
+        ),
+        (
+            OPEN_DAY.format(where='id = last_insert_rowid()'),
+            [datetime.utcnow().date().isoformat()]
+        ),
+    ])
+    challenge = created.rows[0]
     
     return jsonify({
         'success': True,
@@ -41,6 +50,7 @@ def mock_checkout():
     }), 201
 
 @checkout_bp.route('/paypal-status', methods=['GET'])
+@http_cached(max_age=60, s_maxage=300, stale_while_revalidate=600)
 def get_paypal_status():
     setting = fetch_one('SELECT * FROM paypal_settings LIMIT 1', [])
     return jsonify({'enabled': setting['enabled'] if setting else False})
@@ -0,0 +1,43 @@
+from flask import Blueprint, request, jsonify
+import hmac
+import os
+from routes.market import mark_prices
+from services.daily_metrics import rollover
+from services.drawdown import drawdowns
+from services.positions import mark_to_market
+from services.rule_sweeper import sweep_rules
+
+cron_bp = Blueprint('cron', __name__)
+
+# Scheduled endpoints, called by Vercel Cron (see vercel.json). Vercel sends
+# "Authorization: Bearer $CRON_SECRET"; without CRON_SECRET set they are
+# disabled.
+
+def cron_authorized():
+    secret = os.environ.get('CRON_SECRET')
+    if not secret:
+        return False
+    return hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {secret}')
+
+@cron_bp.route('/sweep', methods=['GET'])
+def sweep():
+    """Revalue open positions, then check the rules of every active challenge"""
+    if not cron_authorized():
+        return jsonify({'error': 'Unauthorized'}), 401
+
+    marked = mark_to_market(mark_prices)
+    # The sweep reads the intraday drawdowns from daily_metrics
+    drawdowns.flush()
+    return jsonify({
+        'mark_to_market': marked,
+        'rules': sweep_rules(),
+    })
+
+@cron_bp.route('/rollover', methods=['GET'])
+def daily_rollover():
+    """UTC midnight: close yesterday's daily metrics and open today's"""
+    if not cron_authorized():
+        return jsonify({'error': 'Unauthorized'}), 401
+
+    drawdowns.flush()
+    return jsonify(rollover())
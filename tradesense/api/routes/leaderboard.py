@@ -1,28 +1,16 @@
 from flask import Blueprint, jsonify
-from db import fetch_all
-from datetime import datetime
+from services.leaderboard import monthly_top
+from http_cache import http_cached
 
 leaderboard_bp = Blueprint('leaderboard', __name__)
 
 @leaderboard_bp.route('/monthly-top10', methods=['GET'])
+@http_cached(max_age=30, s_maxage=60, stale_while_revalidate=300)
 def get_monthly_top10():
     try:
-        # SQL Query for monthly top 10 traders
-        sql = """
-            SELECT 
-              u.name,
-              c.current_equity,
-              c.start_balance,
-              ((c.current_equity - c.start_balance) / c.start_balance * 100) as profit_pct
-            FROM challenges c
-            JOIN users u ON c.user_id = u.id
-            WHERE c.status = 'active'
-              AND strftime('%Y-%m', c.created_at) = strftime('%Y-%m', 'now')
-            ORDER BY profit_pct DESC, c.current_equity DESC
-            LIMIT 10
-        """
-        
-        rows = fetch_all(sql, [])
+        # Reads the materialized leaderboard (see services/leaderboard.py):
+        # an index range scan of at most 10 rows, however many challenges exist
+        rows = monthly_top(10)
         
         traders = []
         rank = 1
@@ -1,132 +1,310 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, Response, stream_with_context
 import yfinance as yf
 from datetime import datetime
+import json
+import os
 import random
 import time
+import numpy as np
+from http_cache import http_cached
+from services.quote_cache import QuoteCache
+from services.morocco_scraper import FETCH_DEADLINE_SECONDS, scrape_morocco_stocks, is_morocco_symbol
+from services.price_feed import PriceFeed, FakeUpstream
+from services.price_oracle import PriceOracle, Upstream, DEFAULT_PRICES, is_simulated
+from services.bar_store import BarStore, BAR_DTYPE, INTERVAL_SECONDS, PERIOD_SECONDS, bars_from_frame, load_bars
+from services.ohlcv import ResampleCache, base_interval_for, downsample, to_columns, to_rows
 
 market_bp = Blueprint('market', __name__)
 
-# Cache for mock prices to keep them somewhat consistent
-MOCK_PRICES = {
-    'BTC-USD': 65000.0,
-    'ETH-USD': 3500.0,
-    'AAPL': 180.0,
-    'MSFT': 400.0,
-    'IAM': 105.0,
-    'ATW': 250.0
-}
-
-def get_mock_quote(symbol):
-    base_price = MOCK_PRICES.get(symbol, 100.0)
-    # Random walk: +/- 0.1%
-    change_pct = random.uniform(-0.001, 0.001)
-    new_price = base_price * (1 + change_pct)
-    MOCK_PRICES[symbol] = new_price
+# Shared by all requests of this worker; see services/quote_cache.py
+quote_cache = QuoteCache()
+
+# OHLCV history on local disk, see services/bar_store.py
+bar_store = BarStore()
+# Higher timeframes built from stored finer bars
+resample_cache = ResampleCache()
+
+MAX_BATCH_SYMBOLS = 50
+STREAM_KEEPALIVE_SECONDS = 15
+
+def fetch_yf_quote(symbol):
+    """Fetch a live quote from yfinance; raises when no price is available"""
+    # Using a small timeout or just prepared for failure
+    ticker = yf.Ticker(symbol)
     
-    return {
-        'symbol': symbol,
-        'price': new_price,
-        'change': new_price - base_price,
-        'change_percent': change_pct * 100,
-        'timestamp': datetime.utcnow().isoformat(),
-        'source': 'mock'
-    }
+    # Try history first as it's often more reliable than fast_info
+    hist = ticker.history(period='1d', interval='1m')
+    
+    if not hist.empty:
+        last_row = hist.iloc[-1]
+        price = float(last_row['Close'])
+        prev_close = float(hist.iloc[0]['Close'])
+        change = price - prev_close
+        change_pct = (change / prev_close) * 100 if prev_close else 0
+        
+        return {
+            'symbol': symbol,
+            'price': price,
+            'change': change,
+            'change_percent': change_pct,
+            'timestamp': datetime.utcnow().isoformat(),
+            'source': 'yfinance'
+        }
+    else:
+        # Fallback to fast_info if history fails
+        price = ticker.fast_info.last_price
+        if price is None or price == 0:
+            raise ValueError("No price found")
+            
+        prev_close = ticker.fast_info.previous_close
+        change = price - prev_close
+        change_pct = (change / prev_close) * 100 if prev_close else 0
+        return {
+            'symbol': symbol,
+            'price': float(price),
+            'change': float(change),
+            'change_percent': float(change_pct),
+            'timestamp': datetime.utcnow().isoformat(),
+            'source': 'yfinance_fast'
+        }
+
+def is_fallback(payload):
+    """
+    True for a response body holding a simulated quote or history, or a
+    last known quote served because the upstream failed; such responses
+    are sent with no-store. Quote maps ({'quotes': {...}}) are checked
+    quote by quote.
+    """
+    if not isinstance(payload, dict):
+        return False
+    if payload.get('stale') or is_simulated(payload):
+        return True
+    return any(is_fallback(value) for value in payload.values() if isinstance(value, dict))
 
+# Quote responses follow the quote cache: fresh for its TTL, then served
+# stale by the CDN while one request revalidates
 @market_bp.route('/quote', methods=['GET'])
+@http_cached(max_age=5, s_maxage=5, stale_while_revalidate=55, no_store_if=is_fallback)
 def get_quote():
     symbol = request.args.get('symbol')
     if not symbol:
         return jsonify({'error': 'Symbol required'}), 400
-        
-    try:
-        # Using a small timeout or just prepared for failure
-        ticker = yf.Ticker(symbol)
-        
-        # Try history first as it's often more reliable than fast_info
-        hist = ticker.history(period='1d', interval='1m')
-        
-        if not hist.empty:
-            last_row = hist.iloc[-1]
-            price = float(last_row['Close'])
-            prev_close = float(hist.iloc[0]['Close'])
-            change = price - prev_close
-            change_pct = (change / prev_close) * 100 if prev_close else 0
-            
-            return jsonify({
-                'symbol': symbol,
-                'price': price,
-                'change': change,
-                'change_percent': change_pct,
-                'timestamp': datetime.utcnow().isoformat(),
-                'source': 'yfinance'
-            })
+
+    # Cached, deadline-bound, falls back to the last or a simulated price
+    return jsonify(price_oracle.quote(symbol))
+
+def fetch_yf_quotes(symbols):
+    """
+    Fetch live quotes for several symbols with one yfinance download.
+
+    Returns a dict of the symbols that had data; missing ones are left out.
+    """
+    hist = yf.download(
+        tickers=' '.join(symbols), period='1d', interval='1m',
+        group_by='ticker', threads=True, progress=False
+    )
+    if hist.empty:
+        return {}
+
+    quotes = {}
+    for symbol in symbols:
+        # A single ticker comes back without the ticker column level
+        if len(symbols) == 1 and symbol not in hist.columns.get_level_values(0):
+            closes = hist['Close'].dropna()
+        elif symbol in hist.columns.get_level_values(0):
+            closes = hist[symbol]['Close'].dropna()
         else:
-            # Fallback to fast_info if history fails
-            price = ticker.fast_info.last_price
-            if price is None or price == 0:
-                raise ValueError("No price found")
-                
-            prev_close = ticker.fast_info.previous_close
-            change = price - prev_close
-            change_pct = (change / prev_close) * 100 if prev_close else 0
-            return jsonify({
-                'symbol': symbol,
-                'price': float(price),
-                'change': float(change),
-                'change_percent': float(change_pct),
-                'timestamp': datetime.utcnow().isoformat(),
-                'source': 'yfinance_fast'
-            })
-            
-    except Exception as e:
-        print(f"Market API Error for {symbol}: {str(e)}. Using mock data.")
-        return jsonify(get_mock_quote(symbol))
+            continue
+        if closes.empty:
+            continue
+
+        price = float(closes.iloc[-1])
+        prev_close = float(closes.iloc[0])
+        change = price - prev_close
+        quotes[symbol] = {
+            'symbol': symbol,
+            'price': price,
+            'change': change,
+            'change_percent': (change / prev_close) * 100 if prev_close else 0,
+            'timestamp': datetime.utcnow().isoformat(),
+            'source': 'yfinance'
+        }
+    return quotes
+
+@market_bp.route('/quotes', methods=['GET'])
+@http_cached(max_age=5, s_maxage=5, stale_while_revalidate=55, no_store_if=is_fallback)
+def get_quotes():
+    symbols = [s.strip() for s in request.args.get('symbols', '').split(',') if s.strip()]
+    symbols = list(dict.fromkeys(symbols))  # dedupe, keep order
+    if not symbols:
+        return jsonify({'error': 'Symbols required'}), 400
+    if len(symbols) > MAX_BATCH_SYMBOLS:
+        return jsonify({'error': f'At most {MAX_BATCH_SYMBOLS} symbols per request'}), 400
+
+    # One bulk call per upstream for whatever is not cached
+    quotes = price_oracle.quotes(symbols)
+    return jsonify({'quotes': {symbol: quotes[symbol] for symbol in symbols}})
+
+# All price lookups (quotes, trades, the stream) go through the oracle:
+# Moroccan symbols are not on yfinance, the scraper has its own cache.
+# The scraper answers (with simulated data if need be) within its own
+# deadline, which a slow but successful scrape may use up, so the oracle
+# waits a little longer before counting the call as a breaker failure.
+price_oracle = PriceOracle([
+    Upstream('morocco', scrape_morocco_stocks, handles=is_morocco_symbol, cached=False,
+             fetch_fresh=lambda symbol: scrape_morocco_stocks([symbol], allow_stale=False)[symbol],
+             deadline=FETCH_DEADLINE_SECONDS + 1),
+    Upstream('yfinance', fetch_yf_quotes, fetch_one=fetch_yf_quote),
+], quote_cache=quote_cache)
+
+def mark_prices(symbols):
+    """
+    Prices to revalue positions at: symbol -> price for the symbols with a
+    live quote. A simulated or last known price would move real equity, so
+    symbols with only a fallback quote are left out until an upstream
+    answers.
+    """
+    quotes = price_oracle.quotes(symbols)
+    return {
+        symbol: float(quote['price']) for symbol, quote in quotes.items()
+        if not is_simulated(quote) and not quote.get('stale')
+    }
+
+# One poller per worker for all streaming clients; PRICE_FEED_UPSTREAM=fake
+# streams random-walk prices without touching yfinance or Boursenews
+if os.environ.get('PRICE_FEED_UPSTREAM') == 'fake':
+    price_feed = PriceFeed(FakeUpstream(dict(DEFAULT_PRICES), walk=True), quote_cache=quote_cache)
+else:
+    price_feed = PriceFeed(price_oracle, quote_cache=quote_cache)
+
+@market_bp.route('/stream', methods=['GET'])
+def stream_quotes():
+    """
+    Server-Sent Events stream of quote updates for ?symbols=A,B,...
+
+    Each update is a 'quote' event whose data is the quote JSON. Comment
+    lines are sent as keepalives when prices do not move.
+    """
+    symbols = [s.strip() for s in request.args.get('symbols', '').split(',') if s.strip()]
+    if not symbols:
+        return jsonify({'error': 'Symbols required'}), 400
+    if len(symbols) > MAX_BATCH_SYMBOLS:
+        return jsonify({'error': f'At most {MAX_BATCH_SYMBOLS} symbols per request'}), 400
+
+    subscription = price_feed.subscribe(symbols)
+
+    def events():
+        try:
+            yield 'retry: 3000\n\n'
+            while True:
+                quote = subscription.get(timeout=STREAM_KEEPALIVE_SECONDS)
+                if quote is None:
+                    yield ': keepalive\n\n'
+                else:
+                    yield f'event: quote\ndata: {json.dumps(quote)}\n\n'
+        finally:
+            # Runs when the client disconnects and the generator is closed
+            price_feed.unsubscribe(subscription)
+
+    return Response(stream_with_context(events()), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+@market_bp.route('/quote/stats', methods=['GET'])
+def get_quote_cache_stats():
+    return jsonify(quote_cache.stats())
+
+@market_bp.route('/upstreams', methods=['GET'])
+def get_upstream_stats():
+    """Circuit breaker state and latency of each price upstream"""
+    return jsonify(price_oracle.stats())
+
+def fetch_yf_bars(symbol, interval, period=None, start=None):
+    """Fetch OHLCV bars from yfinance, either a whole period or from start (unix seconds)"""
+    ticker = yf.Ticker(symbol)
+    if start is not None:
+        # An epoch is taken as is; a naive datetime would be read in the
+        # exchange's timezone and shift the start by hours
+        hist = ticker.history(start=int(start), interval=interval)
+    else:
+        hist = ticker.history(period=period, interval=interval)
+    return bars_from_frame(hist)
+
+def _mock_bars(symbol, count=50):
+    # Generate mock history: 1 minute bars ending now
+    bars = np.empty(count, dtype=BAR_DTYPE)
+    now = int(time.time())
+    base_price = DEFAULT_PRICES.get(symbol, 100.0)
+    for i in range(count):
+        change = base_price * random.uniform(-0.01, 0.01)
+        bars[i] = (
+            now - (count - i) * 60,
+            base_price,
+            base_price + abs(change),
+            base_price - abs(change),
+            base_price + change,
+            random.randint(100, 1000)
+        )
+        base_price += change
+    return bars
+
+def _history_response(symbol, bars, fmt, max_points, **extra):
+    bars = downsample(bars, max_points)
+    if fmt == 'columnar':
+        payload = {'symbol': symbol, 'format': 'columnar', 'count': len(bars), **to_columns(bars)}
+    else:
+        payload = {'symbol': symbol, 'data': to_rows(bars)}
+    payload.update(extra)
+    return jsonify(payload)
 
 @market_bp.route('/history', methods=['GET'])
+@http_cached(max_age=30, s_maxage=60, stale_while_revalidate=300, no_store_if=is_fallback)
 def get_history():
+    """
+    OHLCV bars for ?symbol=&interval=&range=.
+
+    format=columnar returns parallel time/open/high/low/close/volume arrays
+    instead of a list of bar objects. max_points caps the number of bars by
+    merging neighbouring bars server-side (OHLC bucket aggregation).
+    """
     symbol = request.args.get('symbol')
     interval = request.args.get('interval', '1m')
     period = request.args.get('range', '1d')
+    fmt = request.args.get('format', 'rows')
     
     if not symbol:
         return jsonify({'error': 'Symbol required'}), 400
+    # interval names a file in the bar store, so only known ones get that far
+    if interval not in INTERVAL_SECONDS:
+        return jsonify({'error': f"interval must be one of {', '.join(INTERVAL_SECONDS)}"}), 400
+    if fmt not in ('rows', 'columnar'):
+        return jsonify({'error': 'format must be rows or columnar'}), 400
+    try:
+        max_points = int(request.args['max_points']) if 'max_points' in request.args else None
+    except ValueError:
+        return jsonify({'error': 'max_points must be an integer'}), 400
+    if max_points is not None and max_points < 2:
+        return jsonify({'error': 'max_points must be at least 2'}), 400
         
     try:
-        ticker = yf.Ticker(symbol)
-        hist = ticker.history(period=period, interval=interval)
+        base_interval = base_interval_for(interval, period)
+        if base_interval:
+            # Derived locally from the finest stored bars, so switching
+            # timeframes costs no upstream call
+            base = load_bars(bar_store, symbol, base_interval, period, fetch_yf_bars)
+            bars = resample_cache.get(symbol, interval, period, base)
+        elif period in PERIOD_SECONDS:
+            # Served from the local bar store; upstream only fills the gaps
+            bars = load_bars(bar_store, symbol, interval, period, fetch_yf_bars)
+        else:
+            # Open-ended ranges (ytd, max) are not cached
+            bars = fetch_yf_bars(symbol, interval, period=period)
         
-        if hist.empty:
+        if len(bars) == 0:
             raise ValueError("History is empty")
 
-        data = []
-        for index, row in hist.iterrows():
-            data.append({
-                'time': int(index.timestamp()),
-                'open': float(row['Open']),
-                'high': float(row['High']),
-                'low': float(row['Low']),
-                'close': float(row['Close']),
-                'volume': int(row['Volume'])
-            })
-            
-        return jsonify({'symbol': symbol, 'data': data})
+        return _history_response(symbol, bars, fmt, max_points)
     except Exception as e:
         print(f"History API Error for {symbol}: {str(e)}. Generating mock history.")
-        # Generate mock history: 50 points
-        data = []
-        now = int(time.time())
-        base_price = MOCK_PRICES.get(symbol, 100.0)
-        for i in range(50):
-            t = now - (50 - i) * 60 # 1 minute intervals
-            change = base_price * random.uniform(-0.01, 0.01)
-            data.append({
-                'time': t,
-                'open': base_price,
-                'high': base_price + abs(change),
-                'low': base_price - abs(change),
-                'close': base_price + change,
-                'volume': random.randint(100, 1000)
-            })
-            base_price += change
-            
-        return jsonify({'symbol': symbol, 'data': data, 'source': 'mock'})
+        return _history_response(symbol, _mock_bars(symbol), fmt, max_points, source='mock')
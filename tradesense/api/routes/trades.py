@@ -1,11 +1,20 @@
 from flask import Blueprint, request, jsonify
+import os
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from db import execute_query, fetch_one, fetch_all
+from db import fetch_one, fetch_all
 from services.challenge_engine import ChallengeEngine
-import yfinance as yf
+from routes.market import price_oracle
+from services.price_oracle import is_simulated
+from models import Trade
+from pagination import page_args, keyset_page, ndjson_response
 
 trades_bp = Blueprint('trades', __name__)
 
+# Demo and development deployments (ALLOW_SIMULATED_FILLS=true) fill orders
+# at simulated prices when no upstream answers, e.g. Moroccan symbols while
+# the scraper has no working source. Otherwise those orders are refused.
+ALLOW_SIMULATED_FILLS = os.environ.get('ALLOW_SIMULATED_FILLS', '').lower() in ('1', 'true')
+
 @trades_bp.route('', methods=['POST'])
 @jwt_required()
 def execute_trade():
@@ -20,108 +29,81 @@ def execute_trade():
     if not all([challenge_id, symbol, side, quantity]):
         return jsonify({'error': 'Missing fields'}), 400
         
-    challenge = fetch_one('SELECT * FROM challenges WHERE id = ?', [challenge_id])
-    if not challenge or str(challenge['user_id']) != str(user_id):
-        return jsonify({'error': 'Challenge not found or unauthorized'}), 404
-        
-    if challenge['status'] != 'active':
-        return jsonify({'error': f'Challenge is {challenge["status"]}, cannot trade'}), 400
+    # Ownership and status are checked inside the order batch below
 
-    # 1. Fetch Current Price
-    try:
-        current_price = None
-        
-        # Try yfinance
-        try:
-            ticker = yf.Ticker(symbol)
-            current_price = ticker.fast_info.last_price
-        except Exception as yf_err:
-            print(f"yfinance error for {symbol}: {yf_err}")
-            hist = ticker.history(period="1d")
-            if not hist.empty:
-                current_price = hist['Close'].iloc[-1]
-
-        if current_price is None:
-            # Fallback prices
-            defaults = {
-                'BTC-USD': 95050.0, 
-                'ETH-USD': 2650.0, 
-                'IAM': 102.50, 
-                'ATW': 485.0,
-                'AAPL': 185.0,
-                'TSLA': 175.0,
-                'GOOGL': 150.0,
-                'MSFT': 415.0,
-                'META': 485.0,
-                'NVDA': 950.0,
-                'AMZN': 178.0
-            }
-            current_price = defaults.get(symbol, 100.0)
-            print(f"Warning: Using fallback price for {symbol}: {current_price}")
-            
-    except Exception as e:
-        print(f"Critical error in execute_trade price fetch: {str(e)}")
-        return jsonify({'error': f'Internal price fetch error: {str(e)}'}), 500
+    # 1. Fetch Current Price (bounded wait, never a quote past the cache
+    # TTL). Orders never fill at a last known price, and at a simulated one
+    # only where ALLOW_SIMULATED_FILLS is set
+    quote = price_oracle.quote(symbol, allow_stale=False)
+    if quote.get('stale') or (is_simulated(quote) and not ALLOW_SIMULATED_FILLS):
+        return jsonify({'error': f'No live price for {symbol}, try again shortly'}), 503
+    current_price = float(quote['price'])
 
-    total_value = float(quantity) * float(current_price)
-    commission = total_value * 0.001  # 0.1% commission
-    
-    # Insert trade
-    execute_query(
-        'INSERT INTO trades (challenge_id, symbol, side, quantity, price, total_value, profit_loss, executed_at) VALUES (?, ?, ?, ?, ?, ?, ?, datetime("now"))',
-        [challenge_id, symbol, side, quantity, current_price, total_value, -commission]
+    # 2. Record the fill, apply it to equity and check the rules in one round trip
+    result, error = ChallengeEngine.execute_order(
+        challenge_id, user_id, symbol, side, quantity, float(current_price)
     )
-    
-    # Get the trade ID
-    trade = fetch_one('SELECT * FROM trades WHERE challenge_id = ? ORDER BY id DESC LIMIT 1', [challenge_id])
-    
-    # Update Equity (deduct commission)
-    new_equity = float(challenge['current_equity']) - commission
-    execute_query(
-        'UPDATE challenges SET current_equity = ? WHERE id = ?',
-        [new_equity, challenge_id]
-    )
-    
-    # Check Rules
-    status_result = ChallengeEngine.evaluate_rules(challenge_id)
-    
-    # Get updated challenge status
-    updated_challenge = fetch_one('SELECT status FROM challenges WHERE id = ?', [challenge_id])
-    
+    if error:
+        message, status_code = error
+        return jsonify({'error': message}), status_code
+
     return jsonify({
         'success': True,
-        'trade_id': trade['id'],
+        'trade_id': result['trade_id'],
         'price': current_price,
-        'challenge_status': updated_challenge['status'],
-        'rules_evaluation': status_result
+        'challenge_status': result['challenge_status'],
+        'intraday_drawdown_pct': result['intraday_drawdown_pct'],
+        'rules_evaluation': result['rules_evaluation']
     }), 201
 
+def fetch_trades(challenge_id, after, limit):
+    """A challenge's trades, newest first, after the (executed_at, id) key"""
+    if after is None:
+        return fetch_all(
+            'SELECT * FROM trades WHERE challenge_id = ? ORDER BY executed_at DESC, id DESC LIMIT ?',
+            [challenge_id, limit]
+        )
+    return fetch_all(
+        'SELECT * FROM trades WHERE challenge_id = ? AND (executed_at, id) < (?, ?) '
+        'ORDER BY executed_at DESC, id DESC LIMIT ?',
+        [challenge_id, after[0], after[1], limit]
+    )
+
+def trade_key(trade):
+    return trade['executed_at'], trade['id']
+
+def trade_to_dict(trade):
+    return Trade.from_row(trade).to_dict()
+
 @trades_bp.route('', methods=['GET'])
 @jwt_required()
 def get_trades():
+    """
+    A challenge's trades, newest first, ?limit= per page (default 100).
+    Pass the returned next_cursor as ?cursor= for the next page.
+    format=ndjson streams all remaining trades (up to limit if given), one
+    JSON object per line.
+    """
     user_id = get_jwt_identity()
     challenge_id = request.args.get('challenge_id')
     
     if not challenge_id:
         return jsonify({'error': 'Challenge ID required'}), 400
+    try:
+        limit, after = page_args(request.args, key_size=2)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
         
-    challenge = fetch_one('SELECT * FROM challenges WHERE id = ?', [challenge_id])
+    challenge = fetch_one('SELECT user_id FROM challenges WHERE id = ?', [challenge_id])
     if not challenge or str(challenge['user_id']) != str(user_id):
         return jsonify({'error': 'Unauthorized'}), 404
-        
-    trades = fetch_all('SELECT * FROM trades WHERE challenge_id = ? ORDER BY executed_at DESC', [challenge_id])
-    
-    trades_list = []
-    for trade in trades:
-        trades_list.append({
-            'id': trade['id'],
-            'symbol': trade['symbol'],
-            'side': trade['side'],
-            'quantity': trade['quantity'],
-            'price': float(trade.get('price', 0)),
-            'total_value': float(trade.get('total_value', 0)),
-            'profit_loss': float(trade.get('profit_loss', 0)),
-            'executed_at': trade.get('executed_at')
-        })
-    
-    return jsonify({'trades': trades_list})
+
+    def fetch(after, n):
+        return fetch_trades(challenge_id, after, n)
+
+    if request.args.get('format') == 'ndjson':
+        return ndjson_response(fetch, after, trade_key, trade_to_dict,
+                               limit=limit if 'limit' in request.args else None)
+
+    trades, next_cursor = keyset_page(fetch, after, limit, trade_key)
+    return jsonify({'trades': [trade_to_dict(t) for t in trades], 'next_cursor': next_cursor})
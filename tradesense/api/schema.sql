@@ -18,6 +18,8 @@ CREATE TABLE IF NOT EXISTS plans (
     price_dh DECIMAL(10, 2) NOT NULL,
     start_balance DECIMAL(10, 2) NOT NULL,
     features_json TEXT,
+    -- Limits and extra rules of the plan's challenges, see services/rules.py
+    rules_json TEXT,
     created_at DATETIME DEFAULT CURRENT_TIMESTAMP
 );
 
@@ -36,6 +38,7 @@ CREATE TABLE IF NOT EXISTS challenges (
     created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
     passed_at DATETIME,
     failed_at DATETIME,
+    version INTEGER NOT NULL DEFAULT 0,
     FOREIGN KEY (user_id) REFERENCES users(id),
     FOREIGN KEY (plan_id) REFERENCES plans(id)
 );
@@ -54,6 +57,30 @@ CREATE TABLE IF NOT EXISTS trades (
     FOREIGN KEY (challenge_id) REFERENCES challenges(id)
 );
 
+-- Open positions, one row per challenge and symbol. quantity is signed
+-- (negative for shorts) and avg_price is the average cost of the open
+-- quantity. Fills update the row in the order batch, and unrealized_pnl is the
+-- open quantity valued at mark_price, the last fill or mark-to-market price.
+-- last_realized_pnl/last_equity_delta hold what the latest fill or mark did,
+-- so the same batch can apply it to the trade and the challenge equity.
+-- version is bumped by every fill and mark, like challenges.version.
+CREATE TABLE IF NOT EXISTS positions (
+    challenge_id INTEGER NOT NULL,
+    symbol VARCHAR(20) NOT NULL,
+    quantity INTEGER NOT NULL DEFAULT 0,
+    avg_price DECIMAL(10, 4) NOT NULL DEFAULT 0,
+    realized_pnl DECIMAL(12, 2) NOT NULL DEFAULT 0,
+    mark_price DECIMAL(10, 4),
+    unrealized_pnl DECIMAL(12, 2) NOT NULL DEFAULT 0,
+    last_realized_pnl DECIMAL(12, 2) NOT NULL DEFAULT 0,
+    last_equity_delta DECIMAL(12, 2) NOT NULL DEFAULT 0,
+    marked_at VARCHAR(32),
+    version INTEGER NOT NULL DEFAULT 0,
+    updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (challenge_id, symbol),
+    FOREIGN KEY (challenge_id) REFERENCES challenges(id)
+);
+
 -- Daily metrics table
 CREATE TABLE IF NOT EXISTS daily_metrics (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -81,6 +108,63 @@ CREATE TABLE IF NOT EXISTS paypal_settings (
 -- Create indexes for better query performance
 CREATE INDEX IF NOT EXISTS idx_challenges_user_id ON challenges(user_id);
 CREATE INDEX IF NOT EXISTS idx_challenges_status ON challenges(status);
+-- Admin console: newest-first keyset pages, optionally filtered by status
+CREATE INDEX IF NOT EXISTS idx_challenges_created ON challenges(created_at, id);
+CREATE INDEX IF NOT EXISTS idx_challenges_status_created ON challenges(status, created_at, id);
 CREATE INDEX IF NOT EXISTS idx_trades_challenge_id ON trades(challenge_id);
 CREATE INDEX IF NOT EXISTS idx_trades_executed_at ON trades(executed_at);
+-- Keyset pagination of a challenge's trades: (executed_at, id) DESC
+CREATE INDEX IF NOT EXISTS idx_trades_challenge_executed ON trades(challenge_id, executed_at, id);
 CREATE INDEX IF NOT EXISTS idx_daily_metrics_challenge_id ON daily_metrics(challenge_id);
+
+-- Monthly leaderboard: one row per active challenge, keyed by the month it
+-- was created in. Kept up to date by the triggers below, so the top 10 is
+-- an index range scan. Rebuild with: python jobs.py rebuild-leaderboard
+CREATE TABLE IF NOT EXISTS leaderboard_monthly (
+    month CHAR(7) NOT NULL,
+    challenge_id INTEGER NOT NULL,
+    user_name VARCHAR(255) NOT NULL,
+    start_balance DECIMAL(10, 2) NOT NULL,
+    current_equity DECIMAL(10, 2) NOT NULL,
+    profit_pct REAL NOT NULL,
+    PRIMARY KEY (month, challenge_id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_leaderboard_monthly_rank ON leaderboard_monthly(month, profit_pct DESC, current_equity DESC);
+
+CREATE TRIGGER IF NOT EXISTS trg_leaderboard_challenge_insert
+AFTER INSERT ON challenges WHEN NEW.status = 'active'
+BEGIN
+    INSERT OR REPLACE INTO leaderboard_monthly (month, challenge_id, user_name, start_balance, current_equity, profit_pct)
+    SELECT strftime('%Y-%m', NEW.created_at), NEW.id, u.name, NEW.start_balance, NEW.current_equity,
+           COALESCE((NEW.current_equity - NEW.start_balance) * 100.0 / NULLIF(NEW.start_balance, 0), 0)
+    FROM users u WHERE u.id = NEW.user_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_leaderboard_challenge_update
+AFTER UPDATE OF current_equity, status ON challenges WHEN NEW.status = 'active'
+BEGIN
+    INSERT OR REPLACE INTO leaderboard_monthly (month, challenge_id, user_name, start_balance, current_equity, profit_pct)
+    SELECT strftime('%Y-%m', NEW.created_at), NEW.id, u.name, NEW.start_balance, NEW.current_equity,
+           COALESCE((NEW.current_equity - NEW.start_balance) * 100.0 / NULLIF(NEW.start_balance, 0), 0)
+    FROM users u WHERE u.id = NEW.user_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_leaderboard_challenge_closed
+AFTER UPDATE OF status ON challenges WHEN NEW.status IS NOT 'active'
+BEGIN
+    DELETE FROM leaderboard_monthly WHERE month = strftime('%Y-%m', OLD.created_at) AND challenge_id = OLD.id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_leaderboard_challenge_delete
+AFTER DELETE ON challenges
+BEGIN
+    DELETE FROM leaderboard_monthly WHERE month = strftime('%Y-%m', OLD.created_at) AND challenge_id = OLD.id;
+END;
+
+-- Migrations for databases created before the columns above existed.
+-- seed.py skips a migration whose column is already present.
+-- challenges.version is bumped on every equity or status write (optimistic concurrency)
+ALTER TABLE challenges ADD COLUMN version INTEGER NOT NULL DEFAULT 0;
+-- plans.rules_json holds per-plan challenge rules
+ALTER TABLE plans ADD COLUMN rules_json TEXT;
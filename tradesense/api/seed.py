@@ -3,25 +3,42 @@ Seed script to populate Turso database with initial data
 Run this script once to set up your database
 """
 import os
-import asyncio
+import re
 from dotenv import load_dotenv
-from libsql_client import create_client
 import json
 from werkzeug.security import generate_password_hash
 
 # Load environment variables from parent directory
 load_dotenv('../.env.local')
 
-async def run_seed():
+from db import execute_query, execute_many, execute_batch, close_db
+from services.leaderboard import rebuild_leaderboard
+from services.daily_metrics import rollover
+
+def split_statements(sql):
+    """Split a schema file on ';', keeping CREATE TRIGGER ... END bodies whole"""
+    statements, current = [], ''
+    for part in sql.split(';'):
+        current = f'{current};{part}' if current else part
+        # A trigger body holds ';'-terminated statements up to its END
+        if re.search(r'\bCREATE\s+TRIGGER\b', current, re.I) and not re.search(r'\bEND\s*$', current, re.I):
+            continue
+        if current.strip():
+            statements.append(current.strip())
+        current = ''
+    return statements
+
+def run_seed():
     # Connect to Turso
     url = os.environ.get('TURSO_DATABASE_URL')
     auth_token = os.environ.get('TURSO_AUTH_TOKEN')
 
-    if not url or not auth_token:
+    if not url or (not auth_token and not url.startswith('file:')):
         print("Error: TURSO_DATABASE_URL and TURSO_AUTH_TOKEN must be set in .env.local")
         exit(1)
 
-    async with create_client(url=url, auth_token=auth_token) as db:
+    try:
+        execute_query('SELECT 1')
         print("Connected to Turso database")
 
         # Read and execute schema
@@ -29,13 +46,16 @@ async def run_seed():
         with open('schema.sql', 'r') as f:
             schema_sql = f.read()
             # Split by semicolon and execute each statement
-            statements = [s.strip() for s in schema_sql.split(';') if s.strip()]
+            statements = split_statements(schema_sql)
             for statement in statements:
                 try:
-                    await db.execute(statement)
+                    execute_query(statement)
                     print(f"✓ Executed: {statement[:50]}...")
                 except Exception as e:
-                    print(f"✗ Error: {e}")
+                    if 'duplicate column name' in str(e):
+                        print(f"✓ Already applied: {statement[:50]}...")
+                    else:
+                        print(f"✗ Error: {e}")
 
         print("\nSeeding plans...")
         plans = [
@@ -64,20 +84,24 @@ async def run_seed():
             ]))
         ]
 
-        for slug, name, price, balance, features in plans:
-            try:
-                await db.execute(
-                    'INSERT INTO plans (slug, name, price_dh, start_balance, features_json) VALUES (?, ?, ?, ?, ?)',
-                    [slug, name, price, balance, features]
-                )
-                print(f"✓ Created plan: {name}")
-            except Exception as e:
-                print(f"✗ Plan {name} already exists or error: {e}")
+        # All plans go out in one atomic batch; existing slugs are skipped
+        try:
+            results = execute_many(
+                'INSERT OR IGNORE INTO plans (slug, name, price_dh, start_balance, features_json) VALUES (?, ?, ?, ?, ?)',
+                [list(plan) for plan in plans]
+            )
+            for (slug, name, price, balance, features), result in zip(plans, results):
+                if result.rows_affected:
+                    print(f"✓ Created plan: {name}")
+                else:
+                    print(f"✗ Plan {name} already exists")
+        except Exception as e:
+            print(f"✗ Error creating plans: {e}")
 
         print("\nCreating admin user...")
         admin_password = generate_password_hash('admin123')
         try:
-            await db.execute(
+            execute_query(
                 'INSERT INTO users (name, email, password_hash, role) VALUES (?, ?, ?, ?)',
                 ['Admin', 'admin@tradesense.ai', admin_password, 'admin']
             )
@@ -92,32 +116,53 @@ async def run_seed():
             ('Youssef Alaoui', 'youssef@demo.com', 5200.0, 1)
         ]
 
+        # Users and their challenges are created in a single batch: two
+        # statements per user, and the challenge insert resolves the user id
+        # in SQL instead of a SELECT round trip per user.
+        password = generate_password_hash('password123')
+        statements = []
         for name, email, equity, plan_id in demo_users:
-            try:
-                password = generate_password_hash('password123')
-                await db.execute(
-                    'INSERT INTO users (name, email, password_hash, role) VALUES (?, ?, ?, ?)',
-                    [name, email, password, 'user']
-                )
-                
-                # Get user ID
-                result = await db.execute('SELECT id FROM users WHERE email = ?', [email])
-                user_id = result.rows[0]['id']
-                
-                # Create challenge
-                await db.execute(
-                    'INSERT INTO challenges (user_id, plan_id, start_balance, current_equity, status) VALUES (?, ?, ?, ?, ?)',
-                    [user_id, plan_id, 5000.0, equity, 'active']
-                )
-                
-                print(f"✓ Created demo user: {name} ({email})")
-            except Exception as e:
-                print(f"✗ Demo user {name} already exists or error: {e}")
+            statements.append((
+                'INSERT OR IGNORE INTO users (name, email, password_hash, role) VALUES (?, ?, ?, ?)',
+                [name, email, password, 'user']
+            ))
+            statements.append((
+                'INSERT INTO challenges (user_id, plan_id, start_balance, current_equity, status) '
+                'SELECT u.id, ?, ?, ?, ? FROM users u WHERE u.email = ? '
+                'AND NOT EXISTS (SELECT 1 FROM challenges c WHERE c.user_id = u.id)',
+                [plan_id, 5000.0, equity, 'active', email]
+            ))
+
+        try:
+            results = execute_batch(statements)
+            for i, (name, email, equity, plan_id) in enumerate(demo_users):
+                if results[2 * i].rows_affected:
+                    print(f"✓ Created demo user: {name} ({email})")
+                else:
+                    print(f"✗ Demo user {name} already exists")
+        except Exception as e:
+            print(f"✗ Error creating demo users: {e}")
+
+        # Backfills the leaderboard of databases created before it existed
+        print("\nRebuilding leaderboard...")
+        try:
+            print(f"✓ {rebuild_leaderboard()} leaderboard rows")
+        except Exception as e:
+            print(f"✗ Error rebuilding leaderboard: {e}")
+
+        # Opens today's daily metrics of the active challenges
+        print("\nOpening daily metrics...")
+        try:
+            print(f"✓ {rollover()['opened']} daily rows opened")
+        except Exception as e:
+            print(f"✗ Error opening daily metrics: {e}")
 
         print("\n✅ Database seeding complete!")
+    finally:
+        close_db()
 
 if __name__ == "__main__":
-    asyncio.run(run_seed())
+    run_seed()
     print("\nYou can now login with:")
     print("  Admin: admin@tradesense.ai / admin123")
     print("  Demo: ahmed@demo.com / password123")
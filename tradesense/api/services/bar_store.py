@@ -0,0 +1,224 @@
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows: only in-process locking
+    fcntl = None
+
+# One record per bar, appended to a flat binary file per (symbol, interval)
+# and read back through np.memmap, so a range query is a binary search on
+# the time column plus a slice copy.
+BAR_DTYPE = np.dtype([
+    ('time', '<i8'),
+    ('open', '<f8'),
+    ('high', '<f8'),
+    ('low', '<f8'),
+    ('close', '<f8'),
+    ('volume', '<i8'),
+])
+
+_DEFAULT_ROOT = os.environ.get('BAR_STORE_DIR') or os.path.join(tempfile.gettempdir(), 'tradesense-bars')
+
+INTERVAL_SECONDS = {
+    '1m': 60, '2m': 120, '5m': 300, '15m': 900, '30m': 1800,
+    '60m': 3600, '90m': 5400, '1h': 3600,
+    '1d': 86400, '5d': 5 * 86400, '1wk': 7 * 86400,
+    '1mo': 30 * 86400, '3mo': 90 * 86400,
+}
+
+# How often a period is fetched whole again, moving its start forward
+_PERIOD_REFRESH_SECONDS = 86400
+
+PERIOD_SECONDS = {
+    '1d': 86400, '5d': 5 * 86400,
+    '1mo': 30 * 86400, '3mo': 90 * 86400, '6mo': 180 * 86400,
+    '1y': 365 * 86400, '2y': 730 * 86400, '5y': 1826 * 86400, '10y': 3652 * 86400,
+}
+
+
+def empty_bars():
+    return np.empty(0, dtype=BAR_DTYPE)
+
+
+def bars_from_frame(hist):
+    """Convert a yfinance OHLCV DataFrame into a BAR_DTYPE array (vectorized)"""
+    bars = np.empty(len(hist), dtype=BAR_DTYPE)
+    if len(hist) == 0:
+        return bars
+    # .values is UTC for tz-aware indexes; casting fixes the unit whatever
+    # resolution pandas chose
+    bars['time'] = np.asarray(hist.index.values, dtype='datetime64[s]').astype('i8')
+    bars['open'] = hist['Open'].to_numpy(dtype='f8')
+    bars['high'] = hist['High'].to_numpy(dtype='f8')
+    bars['low'] = hist['Low'].to_numpy(dtype='f8')
+    bars['close'] = hist['Close'].to_numpy(dtype='f8')
+    bars['volume'] = hist['Volume'].fillna(0).to_numpy(dtype='i8')
+    # yfinance occasionally returns rows without prices
+    return bars[~np.isnan(bars['close'])]
+
+
+class BarStore:
+    """
+    On-disk OHLCV store, one append-only file per (symbol, interval).
+
+    Writers take an exclusive flock and readers a shared one, so several
+    worker processes can share the same directory.
+    """
+
+    def __init__(self, root=_DEFAULT_ROOT):
+        self.root = root
+        self._locks = {}
+        self._locks_guard = threading.Lock()
+
+    def _path(self, symbol, interval):
+        if interval not in INTERVAL_SECONDS:
+            raise ValueError(f"Unknown interval {interval!r}")
+        safe = re.sub(r'[^A-Za-z0-9_.-]', '_', symbol.upper())
+        path = os.path.join(self.root, safe, f'{interval}.bars')
+        # Symbols like '..' survive the substitution above
+        root = os.path.realpath(self.root)
+        if os.path.commonpath([root, os.path.realpath(path)]) != root or safe in ('.', '..'):
+            raise ValueError(f"Invalid symbol {symbol!r}")
+        return path
+
+    @contextmanager
+    def _locked(self, symbol, interval, exclusive):
+        path = self._path(symbol, interval)
+        with self._locks_guard:
+            thread_lock = self._locks.setdefault(path, threading.Lock())
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with thread_lock:
+            if fcntl is None:
+                yield path
+                return
+            with open(path + '.lock', 'a') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+                try:
+                    yield path
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def read(self, symbol, interval, start=None, end=None):
+        """Bars with start <= time <= end (unix seconds), as an in-memory copy"""
+        with self._locked(symbol, interval, exclusive=False) as path:
+            if not os.path.exists(path) or os.path.getsize(path) < BAR_DTYPE.itemsize:
+                return empty_bars()
+            bars = np.memmap(path, dtype=BAR_DTYPE, mode='r')
+            times = bars['time']
+            lo = 0 if start is None else int(np.searchsorted(times, start, side='left'))
+            hi = len(bars) if end is None else int(np.searchsorted(times, end, side='right'))
+            result = np.array(bars[lo:hi])
+            del bars
+            return result
+
+    def last_time(self, symbol, interval):
+        """Time of the newest stored bar, or None"""
+        with self._locked(symbol, interval, exclusive=False) as path:
+            if not os.path.exists(path) or os.path.getsize(path) < BAR_DTYPE.itemsize:
+                return None
+            with open(path, 'rb') as f:
+                f.seek(-BAR_DTYPE.itemsize, os.SEEK_END)
+                return int(np.frombuffer(f.read(BAR_DTYPE.itemsize), dtype=BAR_DTYPE)['time'][0])
+
+    def append(self, symbol, interval, bars):
+        """
+        Append bars (sorted by time). Stored bars at or after the first new
+        bar are replaced, so re-fetching the still-forming last bar updates it.
+        """
+        if len(bars) == 0:
+            return
+        with self._locked(symbol, interval, exclusive=True) as path:
+            mode = 'r+b' if os.path.exists(path) else 'w+b'
+            with open(path, mode) as f:
+                count = os.path.getsize(path) // BAR_DTYPE.itemsize
+                keep = count
+                if count:
+                    stored = np.memmap(f, dtype=BAR_DTYPE, mode='r', shape=(count,))
+                    keep = int(np.searchsorted(stored['time'], bars['time'][0], side='left'))
+                    del stored
+                f.truncate(keep * BAR_DTYPE.itemsize)
+                f.seek(0, os.SEEK_END)
+                f.write(np.ascontiguousarray(bars, dtype=BAR_DTYPE).tobytes())
+
+    def replace(self, symbol, interval, bars):
+        """Replace the whole series"""
+        with self._locked(symbol, interval, exclusive=True) as path:
+            tmp = path + '.tmp'
+            with open(tmp, 'wb') as f:
+                f.write(np.ascontiguousarray(bars, dtype=BAR_DTYPE).tobytes())
+            os.replace(tmp, path)
+
+    def meta(self, symbol, interval):
+        """
+        Bookkeeping for a series (unix seconds): covered_from, the first
+        stored bar; fetched_at, the last upstream call; periods, the first
+        bar and fetch time of each full-period fetch
+        """
+        path = self._path(symbol, interval) + '.json'
+        try:
+            with open(path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def set_meta(self, symbol, interval, **values):
+        path = self._path(symbol, interval) + '.json'
+        meta = self.meta(symbol, interval)
+        meta.update(values)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f'{path}.{os.getpid()}.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(meta, f)
+        os.replace(tmp, path)
+
+
+def load_bars(store, symbol, interval, period, fetch):
+    """
+    Bars for the last `period` from the store, asking upstream only for
+    what is missing.
+
+    fetch(symbol, interval, period=None, start=None) must return a BAR_DTYPE
+    array. yfinance periods count trading sessions, not calendar time (1d
+    on a Sunday is Friday's session), so the full period is fetched once
+    per _PERIOD_REFRESH_SECONDS and its first bar recorded as where the
+    period starts; reads begin there. In between only the tail since the
+    last stored bar is fetched, at most once per interval.
+    """
+    now = int(time.time())
+    step = INTERVAL_SECONDS.get(interval, 86400)
+    meta = store.meta(symbol, interval)
+    periods = meta.get('periods', {})  # period -> [first bar time, fetched_at]
+    last = store.last_time(symbol, interval)
+
+    if last is None or period not in periods or now - periods[period][1] >= _PERIOD_REFRESH_SECONDS:
+        bars = fetch(symbol, interval, period=period)
+        first = int(bars['time'][0]) if len(bars) else now
+        covered_from = meta.get('covered_from')
+        if last is None or covered_from is None or first <= covered_from:
+            store.replace(symbol, interval, bars)
+            # Other periods' starts are only valid while the file reaches back to them
+            periods = {p: v for p, v in periods.items() if v[0] >= first}
+            covered_from = first
+        else:
+            # A longer period is stored; keep its older bars
+            store.append(symbol, interval, bars)
+        periods[period] = [first, now]
+        store.set_meta(symbol, interval, covered_from=covered_from, fetched_at=now, periods=periods)
+    elif now - meta.get('fetched_at', 0) >= step:
+        try:
+            store.append(symbol, interval, fetch(symbol, interval, start=last))
+            store.set_meta(symbol, interval, fetched_at=now)
+        except Exception as e:
+            # Serve what we have; the tail is retried on the next request
+            print(f"Bar store tail fetch failed for {symbol} {interval}: {str(e)}")
+
+    return store.read(symbol, interval, start=periods[period][0])
@@ -1,96 +1,273 @@
 from datetime import datetime
-from db import execute_query, fetch_one
+import random
+import time
+from db import execute_query, execute_batch, fetch_one
+from services.daily_metrics import OPEN_DAY
+from services.drawdown import drawdowns
+from services.rules import has_position_limits, rules_for
+
+COMMISSION_RATE = 0.001  # 0.1% commission
+
+# Optimistic concurrency: equity deltas are applied in SQL, and every equity or
+# status write bumps challenges.version. Decisions taken on a read row (the
+# status change after a rule check) are written conditionally on that version
+# and retried on a fresh read when it moved.
+_MAX_VERSION_RETRIES = 30
+_RETRY_BACKOFF_SECONDS = 0.002
+_RETRY_BACKOFF_CAP_SECONDS = 0.1
+
+
+class ConcurrentUpdateError(RuntimeError):
+    """Raised when a challenge kept changing for every retry of an update"""
+
+
+# Columns needed to evaluate the rules of a challenge. Used both as a
+# SELECT list and as a RETURNING clause on challenges, so the rule check can
+# run on the row an UPDATE just produced without another round trip.
+_SNAPSHOT_COLUMNS = '''
+    id, user_id, plan_id, status, start_balance, current_equity, version,
+    max_daily_loss_pct, max_total_loss_pct, profit_target_pct,
+    (SELECT day_start_equity FROM daily_metrics
+      WHERE challenge_id = challenges.id AND date = ?) AS day_start_equity
+'''
+
+# Position upsert for a fill of excluded.quantity (signed) at
+# excluded.avg_price, matched at average cost. Every expression reads the
+# row as it was before the fill. A fill against the position realizes P&L
+# on the quantity it closes; one that flips the position opens the rest at
+# the fill price.
+_FILL_REALIZED = '''(CASE WHEN quantity * excluded.quantity < 0
+        THEN MIN(ABS(quantity), ABS(excluded.quantity)) * (excluded.avg_price - avg_price)
+             * CASE WHEN quantity > 0 THEN 1 ELSE -1 END
+        ELSE 0 END)'''
+_FILL_POSITION = f'''
+    last_realized_pnl = {_FILL_REALIZED},
+    realized_pnl = realized_pnl + {_FILL_REALIZED},
+    last_equity_delta = {_FILL_REALIZED} - unrealized_pnl,
+    avg_price = CASE
+        WHEN quantity + excluded.quantity = 0 THEN 0
+        WHEN quantity * excluded.quantity >= 0
+            THEN (quantity * avg_price + excluded.quantity * excluded.avg_price) * 1.0 / (quantity + excluded.quantity)
+        WHEN quantity * (quantity + excluded.quantity) > 0 THEN avg_price
+        ELSE excluded.avg_price END,
+    quantity = quantity + excluded.quantity,
+    mark_price = excluded.mark_price,
+    version = version + 1,
+    updated_at = datetime("now")
+'''
 
 class ChallengeEngine:
     @staticmethod
-    def evaluate_rules(challenge_id: int):
+    def execute_order(challenge_id, user_id, symbol: str, side: str, quantity: int, price: float):
         """
-        Evaluates strict prop firm rules after a trade or periodically.
-        
-        Rules:
-        1. Daily Loss Limit (5%): (Start Equity Day X - Current Equity) / Start Equity Day X >= 0.05
-        2. Total Loss Limit (10%): (Initial Balance - Current Equity) / Initial Balance >= 0.10
-        3. Profit Target (10%): (Current Equity - Initial Balance) / Initial Balance >= 0.10
+        Records a fill and applies it to the challenge in one round trip.
+
+        The fill is matched against the open position at average cost: the
+        part that closes it realizes (price - avg_price) per unit, the rest
+        opens or adds to it. The position, the trade (profit_loss = realized
+        P&L - commission) and the equity change (realized P&L + change in
+        unrealized P&L at the fill price - commission) are all computed by the
+        database, guarded by ownership and status, and sent as one atomic
+        batch, so concurrent orders on one challenge never lose an update and
+        need no retry. The updated challenge comes back through RETURNING and
+        the rules are evaluated on it directly; only an order that changes the
+        challenge status costs a second write.
+
+        Returns (result, error) where error is (message, http_status) or None.
         """
-        
-        challenge = fetch_one('SELECT * FROM challenges WHERE id = ?', [challenge_id])
-        if not challenge or challenge['status'] != 'active':
-            return
-            
-        current_equity = float(challenge['current_equity'])
-        start_balance = float(challenge['start_balance'])
-        
-        # 1. Get Daily Start Equity
+        if side not in ('buy', 'sell'):
+            return None, ("side must be 'buy' or 'sell'", 400)
+
+        total_value = float(quantity) * float(price)
+        commission = total_value * COMMISSION_RATE
+        signed_quantity = quantity if side == 'buy' else -quantity
+
+        if has_position_limits():
+            error = ChallengeEngine.check_position_size(challenge_id, symbol, signed_quantity, price)
+            if error:
+                return None, (error, 400)
         today = datetime.utcnow().date().isoformat()
-        daily_metric = fetch_one(
-            'SELECT * FROM daily_metrics WHERE challenge_id = ? AND date = ?',
-            [challenge_id, today]
+        guard = 'SELECT 1 FROM challenges WHERE id = ? AND user_id = ? AND status = ?'
+
+        _, _, _, insert_result, update_result, challenge_result = execute_batch([
+            # The day's first order opens its daily row if the rollover has not
+            (
+                OPEN_DAY.format(where='id = ? AND user_id = ? AND status = ?'),
+                [today, challenge_id, user_id, 'active']
+            ),
+            (
+                'INSERT INTO positions (challenge_id, symbol, quantity, avg_price, mark_price) '
+                'SELECT id, ?, ?, ?, ? FROM challenges WHERE id = ? AND user_id = ? AND status = ? '
+                f'ON CONFLICT (challenge_id, symbol) DO UPDATE SET {_FILL_POSITION}',
+                [symbol, signed_quantity, price, price, challenge_id, user_id, 'active']
+            ),
+            (
+                'UPDATE positions SET unrealized_pnl = quantity * (mark_price - avg_price), '
+                'last_equity_delta = last_equity_delta + quantity * (mark_price - avg_price) '
+                f'WHERE challenge_id = ? AND symbol = ? AND EXISTS ({guard})',
+                [challenge_id, symbol, challenge_id, user_id, 'active']
+            ),
+            (
+                'INSERT INTO trades (challenge_id, symbol, side, quantity, price, total_value, profit_loss, executed_at) '
+                'SELECT id, ?, ?, ?, ?, ?, '
+                '(SELECT last_realized_pnl FROM positions WHERE challenge_id = challenges.id AND symbol = ?) - ?, '
+                'datetime("now") FROM challenges '
+                'WHERE id = ? AND user_id = ? AND status = ? RETURNING id, profit_loss',
+                [symbol, side, quantity, price, total_value, symbol, commission, challenge_id, user_id, 'active']
+            ),
+            (
+                'UPDATE challenges SET current_equity = current_equity - ? + '
+                '(SELECT last_equity_delta FROM positions WHERE challenge_id = challenges.id AND symbol = ?), '
+                'version = version + 1 '
+                f'WHERE id = ? AND user_id = ? AND status = ? RETURNING {_SNAPSHOT_COLUMNS}',
+                [commission, symbol, challenge_id, user_id, 'active', today]
+            ),
+            # Only read when the guarded statements matched nothing, to report why
+            ('SELECT user_id, status FROM challenges WHERE id = ?', [challenge_id]),
+        ])
+
+        if not insert_result.rows or not update_result.rows:
+            challenge = challenge_result.rows[0] if challenge_result.rows else None
+            if not challenge or str(challenge['user_id']) != str(user_id):
+                return None, ('Challenge not found or unauthorized', 404)
+            return None, (f'Challenge is {challenge["status"]}, cannot trade', 400)
+
+        snapshot = dict(zip(update_result.columns, update_result.rows[0]))
+        status_result = ChallengeEngine.apply_rules(snapshot)
+
+        return {
+            'trade_id': insert_result.rows[0]['id'],
+            'commission': commission,
+            'realized_pnl': float(insert_result.rows[0]['profit_loss']) + commission,
+            'current_equity': float(snapshot['current_equity']),
+            'intraday_drawdown_pct': snapshot['intraday_drawdown_pct'],
+            'challenge_status': status_result['status'],
+            'rules_evaluation': status_result
+        }, None
+
+    @staticmethod
+    def check_position_size(challenge_id, symbol: str, signed_quantity: int, price: float):
+        """
+        Error message if the order would grow the position past the plan's
+        max_position_pct. Checked on a read before the order batch, so
+        concurrent orders on one symbol may overshoot it by an order.
+        """
+        row = fetch_one(
+            'SELECT plan_id, start_balance, max_daily_loss_pct, max_total_loss_pct, profit_target_pct, '
+            '(SELECT quantity FROM positions WHERE challenge_id = challenges.id AND symbol = ?) AS quantity '
+            'FROM challenges WHERE id = ?',
+            [symbol, challenge_id]
         )
-        
-        if not daily_metric:
-            day_start_equity = float(challenge['current_equity'])
-        else:
-            day_start_equity = float(daily_metric['day_start_equity'])
-
-        # --- RULE 1: DAILY LOSS (5%) ---
-        if day_start_equity <= 0:
-            day_start_equity = start_balance
-
-        daily_drawdown = day_start_equity - current_equity
-        daily_drawdown_pct = (daily_drawdown / day_start_equity) * 100.0 if day_start_equity > 0 else 0
-        
-        if daily_drawdown_pct >= 5.0:
-            execute_query(
-                'UPDATE challenges SET status = ?, failed_at = datetime("now"), failure_reason = ? WHERE id = ?',
-                ['failed', 'Daily Loss Limit Exceeded (>5%)', challenge_id]
-            )
-            return {
-                'status': 'failed',
-                'reason': f'Daily Loss: -{daily_drawdown_pct:.2f}% (Limit: -5%)'
-            }
-
-        # --- RULE 2: TOTAL LOSS (10%) ---
-        total_drawdown = start_balance - current_equity
-        total_drawdown_pct = (total_drawdown / start_balance) * 100.0 if start_balance > 0 else 0
-        
-        if total_drawdown_pct >= 10.0:
-            execute_query(
-                'UPDATE challenges SET status = ?, failed_at = datetime("now"), failure_reason = ? WHERE id = ?',
-                ['failed', 'Total Loss Limit Exceeded (>10%)', challenge_id]
+        if not row:
+            return None  # reported by the order batch
+        quantity = row['quantity'] or 0
+        return rules_for(row).check_position(row['start_balance'], quantity, quantity + signed_quantity, price)
+
+    @staticmethod
+    def evaluate_snapshot(challenge: dict):
+        """
+        Evaluates the challenge's rules (services/rules.py) on a challenge
+        row with the snapshot columns. Only a challenge that hit its profit
+        target on a plan with history rules costs a query.
+
+        Returns a dict with the resulting status, plus reason and
+        failure_reason when the status changes.
+        """
+        return rules_for(challenge).evaluate(challenge, lambda: ChallengeEngine.trading_stats(challenge['id']))
+
+    @staticmethod
+    def trading_stats(challenge_id: int):
+        """Number of days with trades, and the best day's realized P&L"""
+        return fetch_one(
+            'SELECT COUNT(*) AS trading_days, MAX(pnl) AS best_day_pnl FROM ('
+            'SELECT SUM(profit_loss) AS pnl FROM trades WHERE challenge_id = ? GROUP BY date(executed_at))',
+            [challenge_id]
+        )
+
+    @staticmethod
+    def apply_rules(challenge: dict):
+        """
+        Evaluates a challenge row and persists a status change if there is one.
+
+        The row's equity is recorded in the intraday drawdown tracker first,
+        so every fill, mark and P&L update counts towards the day's worst
+        drawdown without a query. The status write only applies if the row
+        still has the version that was evaluated; otherwise the fresh row is
+        re-read and re-evaluated.
+        """
+        today = datetime.utcnow().date().isoformat()
+
+        for attempt in range(_MAX_VERSION_RETRIES):
+            challenge['intraday_drawdown_pct'] = drawdowns.observe(
+                challenge['id'], float(challenge['current_equity']), challenge.get('day_start_equity')
             )
-            return {
-                'status': 'failed',
-                'reason': f'Total Loss: -{total_drawdown_pct:.2f}% (Limit: -10%)'
-            }
-
-        # --- RULE 3: PROFIT TARGET (10%) ---
-        profit = current_equity - start_balance
-        profit_pct = (profit / start_balance) * 100.0 if start_balance > 0 else 0
-        
-        if profit_pct >= 10.0:
-            execute_query(
-                'UPDATE challenges SET status = ?, passed_at = datetime("now") WHERE id = ?',
-                ['passed', challenge_id]
+            result = ChallengeEngine.evaluate_snapshot(challenge)
+            failure_reason = result.pop('failure_reason', None)
+
+            if result['status'] == 'failed':
+                update = execute_query(
+                    'UPDATE challenges SET status = ?, failed_at = datetime("now"), failure_reason = ?, version = version + 1 '
+                    'WHERE id = ? AND status = ? AND version = ?',
+                    ['failed', failure_reason, challenge['id'], 'active', challenge['version']]
+                )
+            elif result['status'] == 'passed':
+                update = execute_query(
+                    'UPDATE challenges SET status = ?, passed_at = datetime("now"), version = version + 1 '
+                    'WHERE id = ? AND status = ? AND version = ?',
+                    ['passed', challenge['id'], 'active', challenge['version']]
+                )
+            else:
+                return result
+
+            if update.rows_affected:
+                return result
+
+            # Lost the race: another order or an admin changed the challenge
+            time.sleep(random.uniform(0, min(_RETRY_BACKOFF_CAP_SECONDS, _RETRY_BACKOFF_SECONDS * 2 ** attempt)))
+            challenge = fetch_one(
+                f'SELECT {_SNAPSHOT_COLUMNS} FROM challenges WHERE id = ?',
+                [today, challenge['id']]
             )
-            return {
-                'status': 'passed',
-                'reason': f'Profit Target Hit: +{profit_pct:.2f}% (Target: +10%)'
-            }
+            if not challenge or challenge['status'] != 'active':
+                return {'status': challenge['status'] if challenge else 'unknown'}
+
+        raise ConcurrentUpdateError(f"Challenge {challenge['id']} kept changing while applying rules")
+
+    @staticmethod
+    def evaluate_rules(challenge_id: int):
+        """
+        Evaluates strict prop firm rules after a trade or periodically.
+        """
+        today = datetime.utcnow().date().isoformat()
+        challenge = fetch_one(
+            f'SELECT {_SNAPSHOT_COLUMNS} FROM challenges WHERE id = ?',
+            [today, challenge_id]
+        )
+        if not challenge or challenge['status'] != 'active':
+            return
 
-        return {'status': 'active'}
+        return ChallengeEngine.apply_rules(challenge)
 
     @staticmethod
     def calculate_trade_impact(challenge_id: int, pnl: float):
         """
         Updates equity and checks rules immediately.
+
+        The P&L is added by the database rather than written back from a
+        Python read, so concurrent calls on one challenge cannot lose an update.
         """
-        challenge = fetch_one('SELECT * FROM challenges WHERE id = ?', [challenge_id])
-        if challenge:
-            new_equity = float(challenge['current_equity']) + pnl
-            execute_query(
-                'UPDATE challenges SET current_equity = ? WHERE id = ?',
-                [new_equity, challenge_id]
-            )
-            
-            # Re-evaluate
-            return ChallengeEngine.evaluate_rules(challenge_id)
+        today = datetime.utcnow().date().isoformat()
+        update = execute_query(
+            'UPDATE challenges SET current_equity = current_equity + ?, version = version + 1 '
+            f'WHERE id = ? RETURNING {_SNAPSHOT_COLUMNS}',
+            [pnl, challenge_id, today]
+        )
+        if not update.rows:
+            return
+
+        snapshot = dict(zip(update.columns, update.rows[0]))
+        if snapshot['status'] != 'active':
+            return
+
+        # Re-evaluate
+        return ChallengeEngine.apply_rules(snapshot)
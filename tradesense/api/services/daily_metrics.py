@@ -0,0 +1,53 @@
+from datetime import datetime
+
+from db import execute_batch
+
+# One daily_metrics row per challenge and UTC day. Its day_start_equity is
+# what the daily-loss rule measures against, looked up through the
+# (challenge_id, date) unique index. Rows are opened for every active
+# challenge by the midnight rollover, and by the first order of a day if the
+# rollover has not run yet, so the day start never falls back to the
+# current equity.
+
+# Opens the day's row of challenges at their current equity; an existing
+# row (opened earlier in the day) is kept
+OPEN_DAY = '''
+    INSERT INTO daily_metrics (challenge_id, date, day_start_equity)
+    SELECT id, ?, current_equity FROM challenges WHERE {where}
+    ON CONFLICT (challenge_id, date) DO NOTHING
+'''
+
+# Closes every row of an earlier day still open at the challenge's current
+# equity. The intraday drawdown is at least the end-of-day one.
+_CLOSE_DAYS = '''
+    UPDATE daily_metrics SET
+        day_end_equity = c.current_equity,
+        day_pnl = c.current_equity - daily_metrics.day_start_equity,
+        day_pnl_pct = (c.current_equity - daily_metrics.day_start_equity) * 100.0
+                      / NULLIF(daily_metrics.day_start_equity, 0),
+        max_intraday_drawdown_pct = MAX(
+            COALESCE(daily_metrics.max_intraday_drawdown_pct, 0),
+            COALESCE((daily_metrics.day_start_equity - c.current_equity) * 100.0
+                     / NULLIF(daily_metrics.day_start_equity, 0), 0)
+        )
+    FROM challenges c
+    WHERE daily_metrics.challenge_id = c.id
+      AND daily_metrics.date < ? AND daily_metrics.day_end_equity IS NULL
+'''
+
+
+def rollover(today=None):
+    """
+    UTC-midnight rollover, in one atomic batch of two set-based statements:
+    close the open rows of earlier days (a missed run is caught up at the
+    current equity) and open today's row for every active challenge.
+
+    today is a date, default the current UTC date. Returns the number of
+    rows closed and opened.
+    """
+    today = (today or datetime.utcnow().date()).isoformat()
+    closed, opened = execute_batch([
+        (_CLOSE_DAYS, [today]),
+        (OPEN_DAY.format(where="status = 'active'"), [today]),
+    ])
+    return {'closed': closed.rows_affected, 'opened': opened.rows_affected}
@@ -0,0 +1,107 @@
+import json
+import threading
+import time
+from datetime import datetime
+
+from db import execute_query
+
+# Intraday drawdown per challenge: the fall from the day's peak equity, in
+# percent of the peak. Every equity the engine sees (fills, mark-to-market,
+# P&L updates) goes through DrawdownTracker.observe(), an O(1) dict update;
+# the worst value of the day is flushed to daily_metrics.max_intraday_drawdown_pct
+# in batches. Each worker tracks the fills it handles, and the flush keeps
+# the maximum across workers.
+
+_FLUSH_INTERVAL_SECONDS = 5
+# Challenges whose worst drawdown grew that trigger an early flush
+_FLUSH_BATCH = 500
+
+_FLUSH_SQL = '''
+    UPDATE daily_metrics SET max_intraday_drawdown_pct = MAX(COALESCE(max_intraday_drawdown_pct, 0), m.worst)
+    FROM (
+        SELECT json_extract(value, '$[0]') AS challenge_id, json_extract(value, '$[1]') AS worst
+        FROM json_each(?)
+    ) AS m
+    WHERE daily_metrics.challenge_id = m.challenge_id AND daily_metrics.date = ?
+'''
+
+
+class DrawdownTracker:
+    """
+    Peak equity and worst drawdown of the current UTC day for every
+    challenge seen, reset when the day changes. The day's first
+    observation starts the peak at the day start equity.
+    """
+
+    def __init__(self, flush_interval=_FLUSH_INTERVAL_SECONDS, flush_batch=_FLUSH_BATCH):
+        self.flush_interval = flush_interval
+        self.flush_batch = flush_batch
+        self._day = None
+        self._state = {}  # challenge_id -> [peak equity, worst drawdown %]
+        self._dirty = set()  # challenges whose worst drawdown grew since the last flush
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+
+    def observe(self, challenge_id, equity, day_start_equity=None):
+        """Record an equity value; returns the challenge's worst drawdown today, in percent"""
+        today = datetime.utcnow().date().isoformat()
+        pending = None
+        with self._lock:
+            if today != self._day:
+                pending = self._take()
+                self._day = today
+                self._state.clear()
+
+            state = self._state.get(challenge_id)
+            if state is None:
+                start = equity if day_start_equity is None else float(day_start_equity)
+                state = self._state[challenge_id] = [max(start, equity), 0.0]
+            elif equity > state[0]:
+                state[0] = equity
+
+            drawdown = (state[0] - equity) / state[0] * 100.0 if state[0] > 0 else 0.0
+            if drawdown > state[1]:
+                state[1] = drawdown
+                self._dirty.add(challenge_id)
+
+            worst = state[1]
+            if pending is None and self._dirty and (
+                len(self._dirty) >= self.flush_batch
+                or time.monotonic() - self._last_flush >= self.flush_interval
+            ):
+                pending = self._take()
+
+        if pending:
+            self._write(*pending)
+        return worst
+
+    def flush(self):
+        """Write the pending worst drawdowns now; returns how many"""
+        with self._lock:
+            pending = self._take()
+        if not pending:
+            return 0
+        self._write(*pending)
+        return len(pending[1])
+
+    def _take(self):
+        # Caller holds the lock
+        self._last_flush = time.monotonic()
+        if not self._dirty:
+            return None
+        items = [[challenge_id, round(self._state[challenge_id][1], 4)] for challenge_id in self._dirty]
+        self._dirty = set()
+        return self._day, items
+
+    def _write(self, day, items):
+        try:
+            execute_query(_FLUSH_SQL, [json.dumps(items), day])
+        except Exception as e:
+            print(f"Drawdown flush error: {str(e)}")
+            # Retried with the next flush, unless the day has moved on
+            with self._lock:
+                if day == self._day:
+                    self._dirty.update(challenge_id for challenge_id, _ in items)
+
+
+drawdowns = DrawdownTracker()
@@ -0,0 +1,80 @@
+import csv
+import io
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # optional, only needed for Parquet exports
+    pa = None
+
+# Streaming encoders for admin exports. Both take an iterable of row
+# batches (see pagination.iter_keyset) and yield the encoded file piece by
+# piece, one piece per batch, so the whole table is never held in memory.
+
+_ARROW_TYPES = {int: 'int64', float: 'float64', str: 'string'}
+
+
+def parquet_available():
+    return pa is not None
+
+
+def csv_stream(batches, columns):
+    """CSV text: a header line, then the rows of each batch"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    yield buffer.getvalue()
+    for batch in batches:
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows([row[c] for c in columns] for row in batch)
+        yield buffer.getvalue()
+
+
+class _Sink:
+    """Write-only file object whose contents are handed out as they are written"""
+
+    def __init__(self):
+        self.closed = False
+        self._parts = []
+        self._position = 0
+
+    def write(self, data):
+        self._parts.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b''.join(self._parts)
+        self._parts = []
+        return data
+
+
+def parquet_stream(batches, columns):
+    """
+    Parquet file bytes with one row group per batch. columns maps column
+    name -> Python type (int, float or str).
+    """
+    schema = pa.schema([(name, _ARROW_TYPES[kind]) for name, kind in columns.items()])
+    sink = _Sink()
+    writer = pq.ParquetWriter(pa.PythonFile(sink, mode='w'), schema)
+    try:
+        for batch in batches:
+            table = pa.table(
+                {name: [row[name] for row in batch] for name in columns}, schema=schema
+            )
+            writer.write_table(table)
+            yield sink.drain()
+    finally:
+        # Footer
+        writer.close()
+    yield sink.drain()
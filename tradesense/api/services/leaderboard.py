@@ -0,0 +1,39 @@
+from db import execute_batch, fetch_all
+
+# leaderboard_monthly is maintained by triggers on challenges (schema.sql);
+# these helpers only read it and rebuild it from scratch.
+# (* 100.0 first: start_balance is often stored as an integer)
+
+_PROFIT_PCT = "COALESCE((c.current_equity - c.start_balance) * 100.0 / NULLIF(c.start_balance, 0), 0)"
+
+
+def monthly_top(limit=10, month=None):
+    """Top active challenges of a month ('YYYY-MM', default the current one)"""
+    return fetch_all(
+        """
+        SELECT user_name AS name, current_equity, start_balance, profit_pct
+        FROM leaderboard_monthly
+        WHERE month = COALESCE(?, strftime('%Y-%m', 'now'))
+        ORDER BY profit_pct DESC, current_equity DESC
+        LIMIT ?
+        """,
+        [month, limit]
+    )
+
+
+def rebuild_leaderboard():
+    """Recompute every row from challenges in one atomic batch; returns the row count"""
+    results = execute_batch([
+        ('DELETE FROM leaderboard_monthly', []),
+        (
+            f"""
+            INSERT INTO leaderboard_monthly (month, challenge_id, user_name, start_balance, current_equity, profit_pct)
+            SELECT strftime('%Y-%m', c.created_at), c.id, u.name, c.start_balance, c.current_equity, {_PROFIT_PCT}
+            FROM challenges c
+            JOIN users u ON c.user_id = u.id
+            WHERE c.status = 'active'
+            """,
+            []
+        ),
+    ])
+    return results[1].rows_affected
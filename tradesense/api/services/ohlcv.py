@@ -0,0 +1,124 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from services.bar_store import BAR_DTYPE, INTERVAL_SECONDS, PERIOD_SECONDS
+
+# Vectorized helpers over BAR_DTYPE arrays (see services/bar_store.py)
+
+COLUMNS = ('time', 'open', 'high', 'low', 'close', 'volume')
+
+
+def aggregate(bars, starts):
+    """
+    Collapse bars into one bar per bucket. starts holds the index of the
+    first bar of every bucket, ascending, starting at 0. Open/close come
+    from the first/last bar of the bucket, high/low are the extremes and
+    volume is summed.
+    """
+    if len(bars) == 0:
+        return bars
+    ends = np.append(starts[1:], len(bars)) - 1
+    out = np.empty(len(starts), dtype=BAR_DTYPE)
+    out['time'] = bars['time'][starts]
+    out['open'] = bars['open'][starts]
+    out['close'] = bars['close'][ends]
+    out['high'] = np.maximum.reduceat(bars['high'], starts)
+    out['low'] = np.minimum.reduceat(bars['low'], starts)
+    out['volume'] = np.add.reduceat(bars['volume'], starts)
+    return out
+
+
+def downsample(bars, max_points):
+    """
+    OHLC bucket aggregation down to at most max_points bars. Unlike picking
+    every n-th bar this keeps every high and low, so wicks do not disappear.
+    """
+    if max_points is None or max_points <= 0 or len(bars) <= max_points:
+        return bars
+    size = -(-len(bars) // max_points)  # ceil
+    return aggregate(bars, np.arange(0, len(bars), size))
+
+
+def resample(bars, seconds):
+    """
+    Build higher-timeframe bars from finer ones. Buckets are aligned to
+    multiples of `seconds` since the epoch (UTC), so 1h bars start on the hour.
+    """
+    if len(bars) == 0:
+        return bars
+    buckets = bars['time'] // seconds * seconds
+    starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+    out = aggregate(bars, starts)
+    out['time'] = buckets[starts]
+    return out
+
+
+# Base series higher timeframes can be derived from, finest first, with the
+# longest range yfinance serves them for
+_BASE_INTERVALS = (
+    ('1m', 7 * 86400),
+    ('5m', 60 * 86400),
+    ('1h', 730 * 86400),
+)
+
+
+def base_interval_for(interval, period):
+    """
+    The finest stored interval that `interval` can be resampled from over
+    `period`, or None when it has to be fetched as is.
+    """
+    target = INTERVAL_SECONDS.get(interval)
+    span = PERIOD_SECONDS.get(period)
+    # Daily and longer bars follow exchange sessions, not UTC buckets
+    if target is None or span is None or target >= 86400:
+        return None
+    for base, max_span in _BASE_INTERVALS:
+        step = INTERVAL_SECONDS[base]
+        if step < target and target % step == 0 and span <= max_span:
+            return base
+    return None
+
+
+class ResampleCache:
+    """
+    Resampled series keyed by (symbol, interval, period), reused as long as
+    the base series they were built from has not changed.
+    """
+
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, symbol, interval, period, base_bars):
+        if len(base_bars) == 0:
+            return base_bars
+        key = (symbol, interval, period)
+        # Cheap fingerprint: the base only ever grows or rewrites its tail
+        signature = (len(base_bars), int(base_bars['time'][0]), int(base_bars['time'][-1]),
+                     float(base_bars['close'][-1]))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == signature:
+                self._entries.move_to_end(key)
+                return entry[1]
+
+        bars = resample(base_bars, INTERVAL_SECONDS[interval])
+        with self._lock:
+            self._entries[key] = (signature, bars)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return bars
+
+
+def to_columns(bars):
+    """Parallel arrays per field, converted to Python lists in C"""
+    return {name: bars[name].tolist() for name in COLUMNS}
+
+
+def to_rows(bars):
+    """One dict per bar (the original /history format)"""
+    return [dict(zip(COLUMNS, row)) for row in bars.tolist()]
@@ -0,0 +1,165 @@
+import json
+from datetime import datetime
+
+import numpy as np
+
+from db import execute_batch, fetch_all
+from services.challenge_engine import ChallengeEngine, _SNAPSHOT_COLUMNS
+
+# Fills update positions inside the order batch (ChallengeEngine.execute_order),
+# which marks the position at the fill price. Between fills, mark_to_market()
+# revalues every open position of every active challenge at the latest
+# prices and moves challenge equity by the change in unrealized P&L.
+
+
+def challenge_positions(challenge_id):
+    """Open positions of one challenge, largest exposure first"""
+    rows = fetch_all(
+        """
+        SELECT symbol, quantity, avg_price, mark_price, realized_pnl, unrealized_pnl, updated_at, marked_at
+        FROM positions WHERE challenge_id = ? AND quantity != 0
+        ORDER BY ABS(quantity * COALESCE(mark_price, avg_price)) DESC
+        """,
+        [challenge_id]
+    )
+    return [{
+        'symbol': row['symbol'],
+        'quantity': row['quantity'],
+        'avg_price': float(row['avg_price']),
+        'mark_price': float(row['mark_price']) if row['mark_price'] is not None else None,
+        'realized_pnl': float(row['realized_pnl']),
+        'unrealized_pnl': float(row['unrealized_pnl']),
+        'updated_at': row['updated_at'],
+        'marked_at': row['marked_at'],
+    } for row in rows]
+
+
+class PositionBook:
+    """
+    Open positions of all active challenges as parallel arrays, one entry
+    per position, so the whole book is revalued in a few array operations
+    whatever the number of challenges.
+    """
+
+    def __init__(self, rows):
+        self.challenge_ids = np.array([row['challenge_id'] for row in rows], dtype='i8')
+        self.symbols = np.array([row['symbol'] for row in rows], dtype=object)
+        self.quantity = np.array([row['quantity'] for row in rows], dtype='f8')
+        self.avg_price = np.array([row['avg_price'] for row in rows], dtype='f8')
+        self.unrealized = np.array([row['unrealized_pnl'] for row in rows], dtype='f8')
+        self.versions = np.array([row['version'] for row in rows], dtype='i8')
+        # Distinct symbols, and each position's index into them
+        if rows:
+            self.universe, self._symbol_index = np.unique(self.symbols, return_inverse=True)
+        else:
+            self.universe, self._symbol_index = np.array([], dtype=object), np.array([], dtype='i8')
+
+    @classmethod
+    def load(cls):
+        """Every open position of every active challenge, in one query"""
+        return cls(fetch_all(
+            """
+            SELECT p.challenge_id, p.symbol, p.quantity, p.avg_price, p.unrealized_pnl, p.version
+            FROM positions p
+            JOIN challenges c ON c.id = p.challenge_id
+            WHERE c.status = 'active' AND p.quantity != 0
+            """
+        ))
+
+    def __len__(self):
+        return len(self.challenge_ids)
+
+    def revalue(self, prices):
+        """
+        Marks and unrealized P&L of every position at prices (symbol ->
+        price). Positions whose symbol has no price keep their current
+        value. Returns (marks, unrealized, moved), moved flagging the
+        positions whose unrealized P&L changed.
+        """
+        lookup = np.array([prices.get(symbol, np.nan) for symbol in self.universe], dtype='f8')
+        marks = lookup[self._symbol_index]
+        priced = ~np.isnan(marks)
+        unrealized = np.where(priced, self.quantity * (marks - self.avg_price), self.unrealized)
+        return marks, unrealized, priced & (unrealized != self.unrealized)
+
+
+def mark_to_market(get_prices):
+    """
+    Revalue all open positions at the latest prices and apply the
+    change in unrealized P&L to each challenge's equity, then run the rules
+    on every challenge that moved.
+
+    The writes are one atomic batch. A position is only written if its
+    version is still the one that was revalued; a fill that landed in
+    between already marked it at the fill price, and the next pass picks it
+    up. The equity change of each challenge is summed by the database from
+    the positions actually written.
+
+    get_prices(symbols) returns symbol -> price for the symbols it has a
+    price for. Returns counts of symbols priced, positions marked,
+    challenges updated and status changes.
+    """
+    book = PositionBook.load()
+    summary = {'symbols': len(book.universe), 'priced': 0, 'positions': 0, 'challenges': 0, 'status_changes': 0}
+    if not len(book):
+        return summary
+
+    prices = get_prices(list(book.universe))
+    summary['priced'] = len(prices)
+
+    marks, unrealized, moved = book.revalue(prices)
+    if not moved.any():
+        return summary
+
+    payload = json.dumps([
+        [int(challenge_id), symbol, int(version), float(mark), float(pnl)]
+        for challenge_id, symbol, version, mark, pnl in zip(
+            book.challenge_ids[moved], book.symbols[moved], book.versions[moved],
+            marks[moved], unrealized[moved]
+        )
+    ])
+    marked_at = datetime.utcnow().isoformat()
+    today = datetime.utcnow().date().isoformat()
+
+    position_result, challenge_result = execute_batch([
+        (
+            """
+            UPDATE positions SET
+                mark_price = m.mark,
+                unrealized_pnl = m.unrealized,
+                last_equity_delta = m.unrealized - positions.unrealized_pnl,
+                marked_at = ?,
+                version = positions.version + 1
+            FROM (
+                SELECT json_extract(value, '$[0]') AS challenge_id, json_extract(value, '$[1]') AS symbol,
+                       json_extract(value, '$[2]') AS version, json_extract(value, '$[3]') AS mark,
+                       json_extract(value, '$[4]') AS unrealized
+                FROM json_each(?)
+            ) AS m
+            WHERE positions.challenge_id = m.challenge_id AND positions.symbol = m.symbol
+              AND positions.version = m.version
+              AND positions.challenge_id IN (SELECT id FROM challenges WHERE status = 'active')
+            """,
+            [marked_at, payload]
+        ),
+        (
+            f"""
+            UPDATE challenges SET current_equity = current_equity + d.delta, version = version + 1
+            FROM (
+                SELECT challenge_id, SUM(last_equity_delta) AS delta
+                FROM positions WHERE marked_at = ? GROUP BY challenge_id
+            ) AS d
+            WHERE challenges.id = d.challenge_id AND challenges.status = 'active'
+            RETURNING {_SNAPSHOT_COLUMNS}
+            """,
+            [marked_at, today]
+        ),
+    ])
+
+    summary['positions'] = position_result.rows_affected
+    summary['challenges'] = len(challenge_result.rows)
+    for row in challenge_result.rows:
+        snapshot = dict(zip(challenge_result.columns, row))
+        if ChallengeEngine.apply_rules(snapshot)['status'] != 'active':
+            summary['status_changes'] += 1
+    return summary
@@ -0,0 +1,168 @@
+import os
+import queue
+import random
+import threading
+import time
+from datetime import datetime
+
+
+_DEFAULT_POLL_INTERVAL_SECONDS = float(os.environ.get('PRICE_FEED_INTERVAL', '2'))
+# Updates buffered per client before the oldest are dropped (slow consumers)
+_SUBSCRIPTION_BUFFER = 256
+# The poller thread exits after this long without subscribers
+_IDLE_SHUTDOWN_SECONDS = 30
+
+
+class FakeUpstream:
+    """
+    In-memory upstream for tests and offline development.
+
+    Prices are set explicitly with set_price, or random-walk on every fetch
+    when walk=True. Every fetch is recorded in calls.
+    """
+
+    def __init__(self, prices=None, walk=False):
+        self.prices = dict(prices or {})
+        self.walk = walk
+        self.calls = []
+
+    def set_price(self, symbol, price):
+        self.prices[symbol] = float(price)
+
+    def fetch(self, symbols):
+        self.calls.append(sorted(symbols))
+        quotes = {}
+        for symbol in symbols:
+            if symbol not in self.prices:
+                if not self.walk:
+                    continue
+                self.prices[symbol] = 100.0
+            elif self.walk:
+                self.prices[symbol] *= 1 + random.uniform(-0.001, 0.001)
+            quotes[symbol] = {
+                'symbol': symbol,
+                'price': self.prices[symbol],
+                'timestamp': datetime.utcnow().isoformat(),
+                'source': 'fake'
+            }
+        return quotes
+
+
+class Subscription:
+    """A client's view of the feed: the symbols it wants and a queue of updates."""
+
+    def __init__(self, symbols):
+        self.symbols = frozenset(symbols)
+        self._queue = queue.Queue(maxsize=_SUBSCRIPTION_BUFFER)
+
+    def push(self, quote):
+        try:
+            self._queue.put_nowait(quote)
+        except queue.Full:
+            # Drop the oldest update; the newest price is the one that matters
+            try:
+                self._queue.get_nowait()
+            except queue.Empty:
+                pass
+            self._queue.put_nowait(quote)
+
+    def get(self, timeout=None):
+        """Next update, or None if none arrived within timeout"""
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class PriceFeed:
+    """
+    Polls upstream once per interval for the union of subscribed symbols and
+    fans the updates out to subscribers, so upstream load grows with the
+    number of distinct symbols rather than the number of clients.
+
+    The poller thread starts with the first subscription and stops after
+    _IDLE_SHUTDOWN_SECONDS without any.
+    """
+
+    def __init__(self, upstream, interval=_DEFAULT_POLL_INTERVAL_SECONDS, quote_cache=None):
+        self.upstream = upstream
+        self.interval = interval
+        self.quote_cache = quote_cache
+        self._subscriptions = set()
+        self._latest = {}  # symbol -> last published quote
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+
+    def subscribe(self, symbols):
+        sub = Subscription(symbols)
+        with self._lock:
+            self._subscriptions.add(sub)
+            latest = [self._latest[s] for s in sub.symbols if s in self._latest]
+            if self._thread is None or not self._thread.is_alive():
+                self._stop.clear()
+                self._thread = threading.Thread(target=self._run, name='price-feed', daemon=True)
+                self._thread.start()
+
+        # Start the client off with whatever we already know
+        for quote in latest:
+            sub.push(quote)
+        return sub
+
+    def unsubscribe(self, sub):
+        with self._lock:
+            self._subscriptions.discard(sub)
+
+    def symbols(self):
+        """Union of all subscribed symbols"""
+        with self._lock:
+            return set().union(*(sub.symbols for sub in self._subscriptions))
+
+    def poll_once(self):
+        """Fetch the subscribed symbols once and publish changed prices"""
+        symbols = self.symbols()
+        if not symbols:
+            return {}
+
+        quotes = self.upstream.fetch(sorted(symbols))
+
+        with self._lock:
+            changed = {}
+            for symbol, quote in quotes.items():
+                previous = self._latest.get(symbol)
+                if previous is None or previous['price'] != quote['price']:
+                    changed[symbol] = quote
+                self._latest[symbol] = quote
+            subscriptions = list(self._subscriptions)
+
+        if self.quote_cache is not None:
+            for symbol, quote in quotes.items():
+                self.quote_cache.put(symbol, quote)
+
+        for sub in subscriptions:
+            for symbol in sub.symbols & changed.keys():
+                sub.push(changed[symbol])
+        return changed
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        idle_since = None
+        while not self._stop.is_set():
+            started = time.monotonic()
+            if self.symbols():
+                idle_since = None
+                try:
+                    self.poll_once()
+                except Exception as e:
+                    print(f"Price feed poll error: {str(e)}")
+            else:
+                idle_since = idle_since or started
+                if started - idle_since > _IDLE_SHUTDOWN_SECONDS:
+                    with self._lock:
+                        # Re-check under the lock so a new subscriber is not stranded
+                        if not self._subscriptions:
+                            self._thread = None
+                            return
+            self._stop.wait(max(0.0, self.interval - (time.monotonic() - started)))
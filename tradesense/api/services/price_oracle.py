@@ -0,0 +1,269 @@
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from datetime import datetime
+
+from services.shared_cache import get_shared_cache
+
+# Last-resort prices when no upstream answers (also the starting points of
+# the simulated random walk)
+DEFAULT_PRICES = {
+    'BTC-USD': 95050.0,
+    'ETH-USD': 2650.0,
+    'IAM': 102.50,
+    'ATW': 485.0,
+    'AAPL': 185.0,
+    'TSLA': 175.0,
+    'GOOGL': 150.0,
+    'MSFT': 415.0,
+    'META': 485.0,
+    'NVDA': 950.0,
+    'AMZN': 178.0
+}
+
+# Longest a caller waits on an upstream before using a fallback price
+_DEFAULT_DEADLINE_SECONDS = float(os.environ.get('PRICE_DEADLINE_SECONDS', '3'))
+# Consecutive failures that open a breaker, and how long it stays open
+_BREAKER_FAILURES = 5
+_BREAKER_RESET_SECONDS = 30
+# Upstream calls running at once; calls past their deadline keep a worker
+# until they return, the breaker stops new ones piling up
+_MAX_WORKERS = 8
+_LATENCY_SAMPLES = 100
+_MOCK_PRICE_TTL_SECONDS = 24 * 3600
+# Sources of made-up prices (the random walks here and in the Morocco scraper)
+SIMULATED_SOURCES = ('mock', 'Morocco (Simulated)')
+
+
+class UpstreamUnavailable(Exception):
+    """The upstream timed out, failed, or its circuit is open"""
+
+
+def mock_quote(symbol):
+    """
+    Simulated quote: a +/- 0.1% random walk from DEFAULT_PRICES, kept in the
+    shared cache so every worker serves the same price.
+    """
+    cache = get_shared_cache()
+    stored = cache.get(f'mock_price:{symbol}')
+    base_price = float(stored) if stored is not None else DEFAULT_PRICES.get(symbol, 100.0)
+    change_pct = random.uniform(-0.001, 0.001)
+    new_price = base_price * (1 + change_pct)
+    cache.set(f'mock_price:{symbol}', repr(new_price), ex=_MOCK_PRICE_TTL_SECONDS)
+
+    return {
+        'symbol': symbol,
+        'price': new_price,
+        'change': new_price - base_price,
+        'change_percent': change_pct * 100,
+        'timestamp': datetime.utcnow().isoformat(),
+        'source': 'mock'
+    }
+
+
+def is_simulated(quote):
+    """True for a made-up price, served when no upstream answered"""
+    return quote.get('source') in SIMULATED_SOURCES
+
+
+class CircuitBreaker:
+    """
+    closed: calls go through. After `failures` consecutive failures the
+    breaker opens and calls are refused for `reset_after` seconds; then one
+    trial call is let through (half_open), which closes it on success or
+    opens it again on failure.
+    """
+
+    def __init__(self, failures=_BREAKER_FAILURES, reset_after=_BREAKER_RESET_SECONDS):
+        self.failures = failures
+        self.reset_after = reset_after
+        self.state = 'closed'
+        self._consecutive = 0
+        self._opened_at = None
+        self._trial_running = False
+        self._latencies = deque(maxlen=_LATENCY_SAMPLES)
+        self._counts = {'calls': 0, 'failures': 0, 'timeouts': 0, 'rejected': 0}
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == 'open' and time.monotonic() - self._opened_at >= self.reset_after:
+                self.state = 'half_open'
+            if self.state == 'closed':
+                return True
+            if self.state == 'half_open' and not self._trial_running:
+                self._trial_running = True
+                return True
+            self._counts['rejected'] += 1
+            return False
+
+    def record(self, latency, ok, timed_out=False):
+        with self._lock:
+            self._counts['calls'] += 1
+            self._latencies.append(latency)
+            if self.state == 'half_open':
+                self._trial_running = False
+            if ok:
+                self._consecutive = 0
+                self.state = 'closed'
+                return
+            self._counts['failures'] += 1
+            if timed_out:
+                self._counts['timeouts'] += 1
+            self._consecutive += 1
+            if self.state == 'half_open' or self._consecutive >= self.failures:
+                self.state = 'open'
+                self._opened_at = time.monotonic()
+
+    def stats(self):
+        with self._lock:
+            latencies = sorted(self._latencies)
+            last = self._latencies[-1] if self._latencies else None
+            stats = dict(self._counts, state=self.state, consecutive_failures=self._consecutive)
+        if latencies:
+            stats['latency_ms'] = {
+                'last': round(last * 1000, 1),
+                'avg': round(sum(latencies) / len(latencies) * 1000, 1),
+                'p95': round(latencies[int(0.95 * (len(latencies) - 1))] * 1000, 1),
+            }
+        return stats
+
+
+class Upstream:
+    """
+    A price source. fetch_many(symbols) returns a dict of the quotes it
+    found; fetch_one(symbol) returns one quote or raises. handles(symbol)
+    routes symbols to it. cached=False for sources with their own cache;
+    fetch_fresh(symbol) then skips that cache's stale window (default
+    fetch_one). deadline overrides the oracle's for a slower source.
+    """
+
+    def __init__(self, name, fetch_many, fetch_one=None, handles=None, cached=True,
+                 fetch_fresh=None, deadline=None):
+        self.name = name
+        self.fetch_many = fetch_many
+        self.fetch_one = fetch_one or (lambda symbol: fetch_many([symbol])[symbol])
+        self.fetch_fresh = fetch_fresh or self.fetch_one
+        self.handles = handles or (lambda symbol: True)
+        self.cached = cached
+        self.deadline = deadline
+        self.breaker = CircuitBreaker()
+
+
+class PriceOracle:
+    """
+    The one way to get a price. Every upstream call has a deadline and goes
+    through the upstream's circuit breaker; when it fails, times out or the
+    breaker is open, callers get the last price seen for the symbol, or a
+    simulated one, instead of waiting.
+
+    fetch() is the raw guarded upstream call (no fallback), used by the
+    price feed; quote()/quotes() add the quote cache and the fallbacks.
+    """
+
+    def __init__(self, upstreams, quote_cache=None, deadline=_DEFAULT_DEADLINE_SECONDS):
+        self.upstreams = upstreams
+        self.quote_cache = quote_cache
+        self.deadline = deadline
+        self._last_good = {}  # symbol -> last upstream quote
+        self._executor = ThreadPoolExecutor(max_workers=_MAX_WORKERS, thread_name_prefix='price-oracle')
+
+    def _route(self, symbol):
+        for upstream in self.upstreams:
+            if upstream.handles(symbol):
+                return upstream
+        raise UpstreamUnavailable(f"No upstream for {symbol}")
+
+    def _call(self, upstream, fn, arg):
+        if not upstream.breaker.allow():
+            raise UpstreamUnavailable(f"{upstream.name} circuit is open")
+        deadline = upstream.deadline or self.deadline
+        started = time.monotonic()
+        future = self._executor.submit(fn, arg)
+        try:
+            result = future.result(timeout=deadline)
+        except FutureTimeout:
+            upstream.breaker.record(time.monotonic() - started, ok=False, timed_out=True)
+            raise UpstreamUnavailable(f"{upstream.name} did not answer within {deadline}s")
+        except Exception:
+            upstream.breaker.record(time.monotonic() - started, ok=False)
+            raise
+        # A bulk call that found nothing is a failure too
+        upstream.breaker.record(time.monotonic() - started, ok=bool(result))
+        if not result:
+            raise UpstreamUnavailable(f"{upstream.name} returned no prices")
+        return result
+
+    def _fetch_one(self, symbol, fresh=False):
+        upstream = self._route(symbol)
+        quote = self._call(upstream, upstream.fetch_fresh if fresh else upstream.fetch_one, symbol)
+        self._last_good[symbol] = quote
+        return quote
+
+    def fetch(self, symbols):
+        """Quotes straight from the upstreams, leaving out symbols they did not return"""
+        quotes = {}
+        for upstream in self.upstreams:
+            wanted = [s for s in symbols if s not in quotes and upstream.handles(s)]
+            if not wanted:
+                continue
+            try:
+                quotes.update(self._call(upstream, upstream.fetch_many, wanted))
+            except Exception as e:
+                print(f"Price upstream {upstream.name} error: {str(e)}")
+        self._last_good.update(quotes)
+        return quotes
+
+    def _fallback(self, symbol, error):
+        print(f"Market API Error for {symbol}: {str(error)}. Using fallback price.")
+        last = self._last_good.get(symbol)
+        if last is not None:
+            return dict(last, stale=True)
+        return mock_quote(symbol)
+
+    def quote(self, symbol, allow_stale=True):
+        """
+        A quote for symbol; never raises. allow_stale=False (pricing
+        orders) never serves a cached quote past its TTL; display
+        endpoints keep the stale-while-revalidate window.
+        """
+        try:
+            upstream = self._route(symbol)
+            if self.quote_cache is None or not upstream.cached:
+                return self._fetch_one(symbol, fresh=not allow_stale)
+            # Dashboards poll the same few symbols, so upstream is asked at
+            # most once per symbol per TTL no matter how many clients poll
+            return self.quote_cache.get(symbol, self._fetch_one, allow_stale=allow_stale)
+        except Exception as e:
+            return self._fallback(symbol, e)
+
+    def quotes(self, symbols):
+        """Quotes for several symbols, with one bulk call per upstream; never raises"""
+        quotes, errors = {}, {}
+        uncached = [s for s in symbols if self.quote_cache is None or not self._route(s).cached]
+        if uncached:
+            quotes.update(self.fetch(uncached))
+        cached = [s for s in symbols if s not in uncached]
+        if cached:
+            found, errors = self.quote_cache.get_many(cached, self.fetch)
+            quotes.update(found)
+        for symbol in symbols:
+            if symbol not in quotes:
+                quotes[symbol] = self._fallback(symbol, errors.get(symbol, 'no price returned'))
+        return quotes
+
+    def price(self, symbol, allow_stale=True):
+        return float(self.quote(symbol, allow_stale)['price'])
+
+    def stats(self):
+        """Breaker state and latency per upstream"""
+        return {
+            'deadline_seconds': self.deadline,
+            'upstreams': {
+                upstream.name: dict(upstream.breaker.stats(), deadline_seconds=upstream.deadline or self.deadline)
+                for upstream in self.upstreams
+            },
+        }
@@ -0,0 +1,189 @@
+import threading
+import time
+
+# How long a quote is served without asking upstream again
+_DEFAULT_TTL_SECONDS = 5
+# How long after expiry a quote may still be served while it is refreshed
+_DEFAULT_STALE_SECONDS = 55
+# How long a caller waits on another caller's upstream fetch
+_FLIGHT_TIMEOUT_SECONDS = 15
+
+
+class _Flight:
+    """One upstream fetch in progress; concurrent callers wait on its event."""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class QuoteCache:
+    """
+    TTL cache keyed by symbol with single-flight loading.
+
+    - fresh entries are returned directly (hit)
+    - entries past their TTL but within the stale window are returned
+      immediately while one background refresh runs (stale-while-revalidate)
+    - on a miss only the first caller runs the loader; concurrent callers for
+      the same symbol wait for its result instead of calling upstream too
+
+    Loader errors are not cached; they are raised to every waiting caller.
+    """
+
+    def __init__(self, ttl=_DEFAULT_TTL_SECONDS, stale_ttl=_DEFAULT_STALE_SECONDS):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self._entries = {}  # symbol -> (value, fetched_at)
+        self._inflight = {}  # symbol -> _Flight
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'stale_hits': 0, 'misses': 0, 'coalesced': 0, 'refreshes': 0, 'errors': 0}
+
+    def get(self, key, loader, allow_stale=True):
+        """
+        Return the cached value for key, calling loader(key) when needed.
+        allow_stale=False skips the stale window: an expired entry is
+        loaded again (or waited on) like a miss.
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, fetched_at = entry
+                age = now - fetched_at
+                if age < self.ttl:
+                    self._stats['hits'] += 1
+                    return dict(value)
+                if allow_stale and age < self.ttl + self.stale_ttl:
+                    self._stats['stale_hits'] += 1
+                    if key not in self._inflight:
+                        flight = self._inflight[key] = _Flight()
+                        self._stats['refreshes'] += 1
+                        threading.Thread(
+                            target=self._load, args=(key, loader, flight), daemon=True
+                        ).start()
+                    return dict(value)
+
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                self._stats['misses'] += 1
+                flight = self._inflight[key] = _Flight()
+            else:
+                self._stats['coalesced'] += 1
+
+        if leader:
+            self._load(key, loader, flight)
+        elif not flight.event.wait(_FLIGHT_TIMEOUT_SECONDS):
+            raise TimeoutError(f"Timed out waiting for quote {key}")
+
+        if flight.error is not None:
+            raise flight.error
+        return dict(flight.value)
+
+    def get_many(self, keys, bulk_loader):
+        """
+        Return cached values for several keys with one bulk_loader call.
+
+        bulk_loader(missing_keys) must return a dict of the values it found.
+        Keys already being fetched by another caller are waited on rather
+        than requested again. Returns (values, errors), both keyed by key.
+        """
+        now = time.monotonic()
+        values, errors = {}, {}
+        leading, waiting, refreshing = {}, {}, {}
+
+        with self._lock:
+            for key in keys:
+                entry = self._entries.get(key)
+                if entry is not None:
+                    value, fetched_at = entry
+                    age = now - fetched_at
+                    if age < self.ttl:
+                        self._stats['hits'] += 1
+                        values[key] = dict(value)
+                        continue
+                    if age < self.ttl + self.stale_ttl:
+                        self._stats['stale_hits'] += 1
+                        values[key] = dict(value)
+                        if key not in self._inflight:
+                            refreshing[key] = self._inflight[key] = _Flight()
+                            self._stats['refreshes'] += 1
+                        continue
+
+                flight = self._inflight.get(key)
+                if flight is None:
+                    self._stats['misses'] += 1
+                    leading[key] = self._inflight[key] = _Flight()
+                else:
+                    self._stats['coalesced'] += 1
+                    waiting[key] = flight
+
+        if refreshing:
+            threading.Thread(
+                target=self._load_many, args=(refreshing, bulk_loader), daemon=True
+            ).start()
+        if leading:
+            self._load_many(leading, bulk_loader)
+
+        for key, flight in list(leading.items()) + list(waiting.items()):
+            if not flight.event.wait(_FLIGHT_TIMEOUT_SECONDS):
+                errors[key] = TimeoutError(f"Timed out waiting for quote {key}")
+            elif flight.error is not None:
+                errors[key] = flight.error
+            else:
+                values[key] = dict(flight.value)
+
+        return values, errors
+
+    def put(self, key, value):
+        """Store a value fetched elsewhere (e.g. by a bulk request)"""
+        with self._lock:
+            self._entries[key] = (value, time.monotonic())
+
+    def _load(self, key, loader, flight):
+        try:
+            flight.value = loader(key)
+            self.put(key, flight.value)
+        except Exception as e:
+            flight.error = e
+            with self._lock:
+                self._stats['errors'] += 1
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            flight.event.set()
+
+    def _load_many(self, flights, bulk_loader):
+        try:
+            found = bulk_loader(list(flights))
+            error = None
+        except Exception as e:
+            found, error = {}, e
+
+        for key, flight in flights.items():
+            if key in found:
+                flight.value = found[key]
+                self.put(key, flight.value)
+            else:
+                flight.error = error or KeyError(f"No quote returned for {key}")
+
+        with self._lock:
+            for key, flight in flights.items():
+                if flight.error is not None:
+                    self._stats['errors'] += 1
+                self._inflight.pop(key, None)
+        for flight in flights.values():
+            flight.event.set()
+
+    def stats(self):
+        """Hit/miss counters and current size"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['size'] = len(self._entries)
+            stats['inflight'] = len(self._inflight)
+        # Coalesced callers waited on a shared fetch, so they count as served
+        served = stats['hits'] + stats['stale_hits'] + stats['coalesced']
+        lookups = served + stats['misses']
+        stats['hit_ratio'] = served / lookups if lookups else 0.0
+        return stats
@@ -0,0 +1,105 @@
+import json
+from collections import defaultdict
+from datetime import datetime
+
+import numpy as np
+
+from db import execute_batch, execute_query
+from services.challenge_engine import ChallengeEngine
+from services.rules import rule_set
+
+# Scheduled rule check over every active challenge. Orders run the rules on
+# the challenge they touch (ChallengeEngine.apply_rules); this catches the
+# ones whose equity moved without a trade, e.g. after mark-to-market.
+
+# Status change guarded like apply_rules: only rows still active and at the
+# version that was evaluated are written, anything that moved in between
+# is left to the order path or the next sweep.
+_SWEEP_UPDATE = '''
+    UPDATE challenges SET status = ?, {stamp} = datetime("now"), failure_reason = ?, version = version + 1
+    WHERE status = 'active' AND (id, version) IN (
+        SELECT json_extract(value, '$[0]'), json_extract(value, '$[1]') FROM json_each(?)
+    )
+    RETURNING id
+'''
+
+
+def load_active(today):
+    """
+    Every active challenge, in one query: (ids, versions, start_balance,
+    equity, day_start_equity, intraday_drawdown_pct) arrays, and the (plan_id, limits) key of each
+    challenge's rule set. A challenge without a daily row for today starts
+    the day at its current equity, as in RuleSet.evaluate.
+    """
+    result = execute_query(
+        """
+        SELECT c.id, c.version, c.start_balance, c.current_equity,
+               COALESCE(d.day_start_equity, c.current_equity) AS day_start_equity,
+               COALESCE(d.max_intraday_drawdown_pct, 0) AS intraday_drawdown_pct,
+               c.plan_id, c.max_daily_loss_pct, c.max_total_loss_pct, c.profit_target_pct
+        FROM challenges c
+        LEFT JOIN daily_metrics d ON d.challenge_id = c.id AND d.date = ?
+        WHERE c.status = 'active'
+        """,
+        [today]
+    )
+    rows = [tuple(row) for row in result.rows]
+    table = np.array([row[:6] for row in rows], dtype='f8').reshape(-1, 6)
+    rule_keys = [row[6:] for row in rows]
+    return (table[:, 0].astype('i8'), table[:, 1].astype('i8'), *table[:, 2:].T), rule_keys
+
+
+def sweep_rules():
+    """
+    Evaluate the rules on every active challenge and write all status
+    changes in one batch. Challenges are grouped by rule set and each group
+    is evaluated as array operations; only challenges at their profit
+    target on a plan with history rules are checked one by one.
+
+    Returns counts of challenges checked, failed and passed, and of changes
+    skipped because the challenge moved meanwhile.
+    """
+    today = datetime.utcnow().date().isoformat()
+    (ids, versions, start_balance, equity, day_start, intraday), rule_keys = load_active(today)
+
+    def pairs(indices):
+        return np.column_stack((ids[indices], versions[indices])).tolist()
+
+    # (status, stamped column, failure reason) -> [[id, version], ...]
+    changes = defaultdict(list)
+    groups = defaultdict(list)
+    for index, key in enumerate(rule_keys):
+        groups[key].append(index)
+
+    for key, members in groups.items():
+        rules = rule_set(*key)
+        members = np.array(members)
+        daily_loss, total_loss, intraday_drawdown, target_hit = rules.evaluate_arrays(
+            start_balance[members], equity[members], day_start[members], intraday[members]
+        )
+        for reason, mask in ((rules.daily_loss_reason, daily_loss), (rules.total_loss_reason, total_loss),
+                             (rules.intraday_drawdown_reason, intraday_drawdown)):
+            if not mask.any():
+                continue
+            changes[('failed', 'failed_at', reason)].extend(pairs(members[mask]))
+
+        passed = members[target_hit]
+        if rules.needs_history:
+            passed = [index for index in passed if rules.evaluate(
+                {'current_equity': equity[index], 'start_balance': start_balance[index],
+                 'day_start_equity': day_start[index]},
+                lambda: ChallengeEngine.trading_stats(int(ids[index]))
+            )['status'] == 'passed']
+        changes[('passed', 'passed_at', None)].extend(pairs(np.array(passed, dtype='i8')))
+
+    changes = [(change, pairs) for change, pairs in changes.items() if pairs]
+    results = execute_batch([
+        (_SWEEP_UPDATE.format(stamp=stamp), [status, reason, json.dumps(pairs)])
+        for (status, stamp, reason), pairs in changes
+    ])
+
+    summary = {'checked': len(ids), 'failed': 0, 'passed': 0, 'skipped': 0}
+    for ((status, _, _), pairs), result in zip(changes, results):
+        summary[status] += len(result.rows)
+        summary['skipped'] += len(pairs) - len(result.rows)
+    return summary
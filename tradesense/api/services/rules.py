@@ -0,0 +1,224 @@
+import json
+from functools import lru_cache
+
+import numpy as np
+
+from db import fetch_all
+
+# Challenge rules. Every challenge has its own loss limits and profit target
+# (the *_pct columns of challenges, copied from its plan at checkout), and
+# its plan may add rules in plans.rules_json:
+#
+#   {"daily_loss_pct": 5, "total_loss_pct": 10, "profit_target_pct": 10,
+#    "min_trading_days": 3, "max_position_pct": 25, "consistency_pct": 40,
+#    "max_intraday_drawdown_pct": 4}
+#
+# - min_trading_days: the profit target only passes the challenge after
+#   trades on at least this many days
+# - max_position_pct: orders may not grow a position past this share of the
+#   starting balance (notional at the order price)
+# - consistency_pct: the profit target only passes the challenge once no
+#   single day made more than this share of the total profit
+# - max_intraday_drawdown_pct: fails the challenge when equity falls this far
+#   below the day's peak (services/drawdown.py)
+#
+# Rules are compiled once into a RuleSet per plan and limits (rule_set()),
+# so orders and sweeps never re-read plans or re-parse their JSON. Plans are
+# read once per process; restart the workers after editing a plan's rules.
+
+DEFAULT_DAILY_LOSS_PCT = 5.0
+DEFAULT_TOTAL_LOSS_PCT = 10.0
+DEFAULT_PROFIT_TARGET_PCT = 10.0
+
+_PLAN_RULE_KEYS = ('min_trading_days', 'max_position_pct', 'consistency_pct', 'max_intraday_drawdown_pct')
+
+
+class RuleSet:
+    """
+    The compiled rules of a challenge: thresholds and messages are fixed at
+    construction, evaluate() only does arithmetic. Shared by every challenge
+    with the same plan and limits, so it must not be mutated.
+    """
+
+    def __init__(self, daily_loss_pct=DEFAULT_DAILY_LOSS_PCT, total_loss_pct=DEFAULT_TOTAL_LOSS_PCT,
+                 profit_target_pct=DEFAULT_PROFIT_TARGET_PCT, min_trading_days=0,
+                 max_position_pct=None, consistency_pct=None, max_intraday_drawdown_pct=None):
+        self.daily_loss_pct = float(daily_loss_pct)
+        self.total_loss_pct = float(total_loss_pct)
+        self.profit_target_pct = float(profit_target_pct)
+        self.min_trading_days = int(min_trading_days or 0)
+        self.max_position_pct = float(max_position_pct) if max_position_pct is not None else None
+        self.consistency_pct = float(consistency_pct) if consistency_pct is not None else None
+        self.max_intraday_drawdown_pct = (
+            float(max_intraday_drawdown_pct) if max_intraday_drawdown_pct is not None else None
+        )
+        self.daily_loss_reason = f'Daily Loss Limit Exceeded (>{self.daily_loss_pct:g}%)'
+        self.total_loss_reason = f'Total Loss Limit Exceeded (>{self.total_loss_pct:g}%)'
+        if self.max_intraday_drawdown_pct is not None:
+            self.intraday_drawdown_reason = (
+                f'Intraday Drawdown Limit Exceeded (>{self.max_intraday_drawdown_pct:g}%)'
+            )
+        else:
+            self.intraday_drawdown_reason = None
+        # Passing needs the trading history only with these rules
+        self.needs_history = self.min_trading_days > 0 or self.consistency_pct is not None
+
+    def evaluate(self, challenge, history=None):
+        """
+        Rules, in order of precedence, on a challenge row:
+        1. Daily loss: (day start equity - equity) / day start equity >= daily_loss_pct
+        2. Total loss: (start balance - equity) / start balance >= total_loss_pct
+        3. Intraday drawdown, if the plan has the rule: the day's worst fall
+           from peak equity (intraday_drawdown_pct) >= max_intraday_drawdown_pct
+        4. Profit target: (equity - start balance) / start balance >= profit_target_pct,
+           then the plan's minimum trading days and consistency rules
+
+        history() returns {'trading_days', 'best_day_pnl'}; it is only
+        called when the profit target is hit and the plan needs it.
+
+        Returns a dict with the resulting status, plus reason and
+        failure_reason when the status changes.
+        """
+        current_equity = float(challenge['current_equity'])
+        start_balance = float(challenge['start_balance'])
+
+        if challenge.get('day_start_equity') is None:
+            day_start_equity = current_equity
+        else:
+            day_start_equity = float(challenge['day_start_equity'])
+        if day_start_equity <= 0:
+            day_start_equity = start_balance
+
+        daily_drawdown_pct = (day_start_equity - current_equity) / day_start_equity * 100.0 if day_start_equity > 0 else 0
+        if daily_drawdown_pct >= self.daily_loss_pct:
+            return {
+                'status': 'failed',
+                'reason': f'Daily Loss: -{daily_drawdown_pct:.2f}% (Limit: -{self.daily_loss_pct:g}%)',
+                'failure_reason': self.daily_loss_reason
+            }
+
+        total_drawdown_pct = (start_balance - current_equity) / start_balance * 100.0 if start_balance > 0 else 0
+        if total_drawdown_pct >= self.total_loss_pct:
+            return {
+                'status': 'failed',
+                'reason': f'Total Loss: -{total_drawdown_pct:.2f}% (Limit: -{self.total_loss_pct:g}%)',
+                'failure_reason': self.total_loss_reason
+            }
+
+        intraday_drawdown_pct = challenge.get('intraday_drawdown_pct') or 0
+        if self.max_intraday_drawdown_pct is not None and intraday_drawdown_pct >= self.max_intraday_drawdown_pct:
+            return {
+                'status': 'failed',
+                'reason': f'Intraday Drawdown: -{intraday_drawdown_pct:.2f}% '
+                          f'(Limit: -{self.max_intraday_drawdown_pct:g}%)',
+                'failure_reason': self.intraday_drawdown_reason
+            }
+
+        profit = current_equity - start_balance
+        profit_pct = -total_drawdown_pct
+        if profit_pct < self.profit_target_pct:
+            return {'status': 'active'}
+
+        if self.needs_history and history is not None:
+            stats = history()
+            if stats['trading_days'] < self.min_trading_days:
+                return {
+                    'status': 'active',
+                    'reason': f"Profit target hit, {stats['trading_days']}/{self.min_trading_days} trading days"
+                }
+            best_day = stats['best_day_pnl'] or 0
+            if self.consistency_pct is not None and best_day > profit * self.consistency_pct / 100.0:
+                return {
+                    'status': 'active',
+                    'reason': f'Profit target hit, best day is {best_day / profit * 100.0:.0f}% of profit '
+                              f'(Limit: {self.consistency_pct:g}%)'
+                }
+
+        return {
+            'status': 'passed',
+            'reason': f'Profit Target Hit: +{profit_pct:.2f}% (Target: +{self.profit_target_pct:g}%)'
+        }
+
+    def evaluate_arrays(self, start_balance, equity, day_start_equity, intraday_drawdown_pct):
+        """
+        evaluate() over arrays of challenges, without the history rules:
+        boolean masks (daily_loss, total_loss, intraday_drawdown, target_hit),
+        at most one set per challenge. day_start_equity must already default
+        to equity.
+        """
+        day_start = np.where(day_start_equity <= 0, start_balance, day_start_equity)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            daily_pct = np.where(day_start > 0, (day_start - equity) / day_start * 100.0, 0.0)
+            total_pct = np.where(start_balance > 0, (start_balance - equity) / start_balance * 100.0, 0.0)
+
+        daily_loss = daily_pct >= self.daily_loss_pct
+        total_loss = ~daily_loss & (total_pct >= self.total_loss_pct)
+        if self.max_intraday_drawdown_pct is not None:
+            intraday = ~daily_loss & ~total_loss & (intraday_drawdown_pct >= self.max_intraday_drawdown_pct)
+        else:
+            intraday = np.zeros_like(daily_loss)
+        target_hit = ~daily_loss & ~total_loss & ~intraday & (-total_pct >= self.profit_target_pct)
+        return daily_loss, total_loss, intraday, target_hit
+
+    def check_position(self, start_balance, quantity, new_quantity, price):
+        """Error message if an order takes a position past max_position_pct, else None"""
+        if self.max_position_pct is None or abs(new_quantity) <= abs(quantity):
+            return None
+        limit = float(start_balance) * self.max_position_pct / 100.0
+        if abs(new_quantity) * float(price) > limit:
+            return f'Position size limit: {limit:.2f} ({self.max_position_pct:g}% of the starting balance)'
+        return None
+
+
+@lru_cache(maxsize=None)
+def _plan_rules():
+    """plan_id -> rules_json of every plan, parsed once per process"""
+    rules = {}
+    for plan in fetch_all('SELECT id, rules_json FROM plans'):
+        try:
+            parsed = json.loads(plan['rules_json']) if plan['rules_json'] else {}
+        except ValueError:
+            print(f"Invalid rules_json for plan {plan['id']}, ignoring it")
+            parsed = {}
+        rules[plan['id']] = parsed
+    return rules
+
+
+def plan_rules(plan_id):
+    """The extra rules of a plan (minimum trading days, position size, consistency)"""
+    rules = _plan_rules().get(plan_id, {})
+    return {key: rules[key] for key in _PLAN_RULE_KEYS if rules.get(key) is not None}
+
+
+def has_position_limits():
+    """Whether any plan limits position size, so orders without one skip the check"""
+    return any(rules.get('max_position_pct') is not None for rules in _plan_rules().values())
+
+
+def plan_limits(plan_id):
+    """Loss limits and profit target a new challenge on the plan starts with"""
+    rules = _plan_rules().get(plan_id, {})
+    return (
+        float(rules.get('daily_loss_pct', DEFAULT_DAILY_LOSS_PCT)),
+        float(rules.get('total_loss_pct', DEFAULT_TOTAL_LOSS_PCT)),
+        float(rules.get('profit_target_pct', DEFAULT_PROFIT_TARGET_PCT)),
+    )
+
+
+@lru_cache(maxsize=1024)
+def rule_set(plan_id, daily_loss_pct, total_loss_pct, profit_target_pct):
+    """The compiled RuleSet for a plan and a challenge's limits (None for the defaults)"""
+    return RuleSet(
+        DEFAULT_DAILY_LOSS_PCT if daily_loss_pct is None else daily_loss_pct,
+        DEFAULT_TOTAL_LOSS_PCT if total_loss_pct is None else total_loss_pct,
+        DEFAULT_PROFIT_TARGET_PCT if profit_target_pct is None else profit_target_pct,
+        **plan_rules(plan_id)
+    )
+
+
+def rules_for(challenge):
+    """The RuleSet of a challenge row with plan_id and the *_pct columns"""
+    return rule_set(
+        challenge.get('plan_id'), challenge.get('max_daily_loss_pct'),
+        challenge.get('max_total_loss_pct'), challenge.get('profit_target_pct')
+    )
@@ -0,0 +1,228 @@
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+
+try:
+    import redis
+except ImportError:  # optional, only needed with REDIS_URL
+    redis = None
+
+# Key/value cache shared by all worker processes, with the subset of the
+# Redis API the app uses: get, set(ex=, nx=), delete, plus batched
+# get_many/set_many and a compare-and-delete (delete(key, value=)) for
+# releasing locks. Values are strings (callers store JSON).
+#
+# Backends, picked by get_shared_cache():
+# - RedisCache when REDIS_URL is set (and the redis package is installed)
+# - SQLiteCache, a WAL-mode database file on local disk (default); shared by
+#   every process on the same machine
+# - MemoryCache, a per-process stand-in (SHARED_CACHE_BACKEND=memory)
+
+_DEFAULT_PATH = os.environ.get('SHARED_CACHE_PATH') or os.path.join(
+    tempfile.gettempdir(), 'tradesense-cache.sqlite3')
+# On average one write in this many also purges expired keys
+_PURGE_EVERY = 256
+
+# Deletes KEYS[1] only if it still holds ARGV[1], atomically on the server
+_REDIS_DELETE_IF = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+class MemoryCache:
+    """In-process stand-in with the same semantics, for tests and single workers"""
+
+    def __init__(self):
+        self._entries = {}  # key -> (value, expires_at or None)
+        self._lock = threading.Lock()
+
+    def _live(self, key, now):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[1] is not None and entry[1] <= now:
+            del self._entries[key]
+            return None
+        return entry[0]
+
+    def get(self, key):
+        with self._lock:
+            return self._live(key, time.time())
+
+    def get_many(self, keys):
+        now = time.time()
+        with self._lock:
+            return {key: value for key in keys if (value := self._live(key, now)) is not None}
+
+    def set(self, key, value, ex=None, nx=False):
+        """Store value, expiring after ex seconds; with nx only if key is absent"""
+        now = time.time()
+        with self._lock:
+            if nx and self._live(key, now) is not None:
+                return False
+            self._entries[key] = (value, now + ex if ex else None)
+            return True
+
+    def set_many(self, mapping, ex=None):
+        expires_at = time.time() + ex if ex else None
+        with self._lock:
+            for key, value in mapping.items():
+                self._entries[key] = (value, expires_at)
+
+    def delete(self, key, value=None):
+        """Remove key; with value only if key still holds it"""
+        with self._lock:
+            if value is not None and self._live(key, time.time()) != value:
+                return False
+            return self._entries.pop(key, None) is not None
+
+
+class SQLiteCache:
+    """
+    Cache table in a local SQLite file in WAL mode, so readers never block
+    the writer and all processes on the host see the same entries.
+    """
+
+    def __init__(self, path=_DEFAULT_PATH):
+        self.path = path
+        self._local = threading.local()
+
+    def _conn(self):
+        # One connection per thread, and new ones after a fork
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS cache '
+                '(key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL)'
+            )
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, key):
+        row = self._conn().execute(
+            'SELECT value FROM cache WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)',
+            (key, time.time())
+        ).fetchone()
+        return row[0] if row else None
+
+    def get_many(self, keys):
+        keys = list(keys)
+        if not keys:
+            return {}
+        placeholders = ','.join('?' * len(keys))
+        rows = self._conn().execute(
+            f'SELECT key, value FROM cache WHERE key IN ({placeholders}) '
+            'AND (expires_at IS NULL OR expires_at > ?)',
+            (*keys, time.time())
+        ).fetchall()
+        return dict(rows)
+
+    def set(self, key, value, ex=None, nx=False):
+        """Store value, expiring after ex seconds; with nx only if key is absent"""
+        now = time.time()
+        expires_at = now + ex if ex else None
+        conn = self._conn()
+        if nx:
+            # Only an expired row may be overwritten; rowcount tells who won
+            cursor = conn.execute(
+                'INSERT INTO cache (key, value, expires_at) VALUES (?, ?, ?) '
+                'ON CONFLICT(key) DO UPDATE SET value = excluded.value, expires_at = excluded.expires_at '
+                'WHERE cache.expires_at IS NOT NULL AND cache.expires_at <= ?',
+                (key, value, expires_at, now)
+            )
+            stored = cursor.rowcount == 1
+        else:
+            conn.execute(
+                'INSERT OR REPLACE INTO cache (key, value, expires_at) VALUES (?, ?, ?)',
+                (key, value, expires_at)
+            )
+            stored = True
+        self._maybe_purge(conn, now)
+        return stored
+
+    def set_many(self, mapping, ex=None):
+        now = time.time()
+        expires_at = now + ex if ex else None
+        conn = self._conn()
+        with conn:  # one transaction
+            conn.execute('BEGIN')
+            conn.executemany(
+                'INSERT OR REPLACE INTO cache (key, value, expires_at) VALUES (?, ?, ?)',
+                [(key, value, expires_at) for key, value in mapping.items()]
+            )
+        self._maybe_purge(conn, now)
+
+    def delete(self, key, value=None):
+        """Remove key; with value only if key still holds it"""
+        if value is None:
+            return self._conn().execute('DELETE FROM cache WHERE key = ?', (key,)).rowcount == 1
+        return self._conn().execute(
+            'DELETE FROM cache WHERE key = ? AND value = ? AND (expires_at IS NULL OR expires_at > ?)',
+            (key, value, time.time())
+        ).rowcount == 1
+
+    def _maybe_purge(self, conn, now):
+        if random.randrange(_PURGE_EVERY) == 0:
+            conn.execute('DELETE FROM cache WHERE expires_at <= ?', (now,))
+
+
+class RedisCache:
+    """Thin wrapper so Redis offers the same get_many/set_many helpers"""
+
+    def __init__(self, url):
+        self._redis = redis.Redis.from_url(url, decode_responses=True)
+
+    def get(self, key):
+        return self._redis.get(key)
+
+    def get_many(self, keys):
+        keys = list(keys)
+        if not keys:
+            return {}
+        return {key: value for key, value in zip(keys, self._redis.mget(keys)) if value is not None}
+
+    def set(self, key, value, ex=None, nx=False):
+        return bool(self._redis.set(key, value, ex=int(ex) if ex else None, nx=nx))
+
+    def set_many(self, mapping, ex=None):
+        pipe = self._redis.pipeline(transaction=False)
+        for key, value in mapping.items():
+            pipe.set(key, value, ex=int(ex) if ex else None)
+        pipe.execute()
+
+    def delete(self, key, value=None):
+        if value is None:
+            return self._redis.delete(key) == 1
+        return self._redis.eval(_REDIS_DELETE_IF, 1, key, value) == 1
+
+
+_shared_cache = None
+_shared_cache_lock = threading.Lock()
+
+
+def get_shared_cache():
+    """The process-wide cache backend, created on first use"""
+    global _shared_cache
+    with _shared_cache_lock:
+        if _shared_cache is None:
+            redis_url = os.environ.get('REDIS_URL')
+            backend = os.environ.get('SHARED_CACHE_BACKEND')
+            if backend == 'memory':
+                _shared_cache = MemoryCache()
+            elif redis_url and redis is not None:
+                _shared_cache = RedisCache(redis_url)
+            else:
+                if redis_url:
+                    print("REDIS_URL is set but the redis package is not installed; using SQLite cache")
+                _shared_cache = SQLiteCache()
+        return _shared_cache
@@ -0,0 +1,130 @@
+"""
+Concurrency stress test for trade execution
+Fires hundreds of parallel orders at two challenges and checks that no
+equity update was lost. The second challenge starts just below its profit
+target, so it passes in the middle of the run while orders race the
+status change.
+
+Runs against a throwaway local database by default. Set
+STRESS_DATABASE_URL (and TURSO_AUTH_TOKEN) to point it at a test Turso
+database instead - never at production, it creates users and challenges.
+"""
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ORDERS_PER_CHALLENGE = 300
+THREADS = 64
+START_BALANCE = 1000000.0
+PRICE = 100.0
+PNL_STEP = 0.5
+TARGET_HEADROOM = 2.0
+
+def setup_database():
+    url = os.environ.get('STRESS_DATABASE_URL')
+    if not url:
+        path = os.path.join(tempfile.mkdtemp(), 'stress.db')
+        url = f'file:{path}'
+    os.environ['TURSO_DATABASE_URL'] = url
+    print(f"Using database: {url}")
+
+    from db import execute_query, execute_batch
+    from seed import split_statements
+
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'schema.sql'), 'r') as f:
+        for statement in split_statements(f.read()):
+            try:
+                execute_query(statement)
+            except Exception as e:
+                if 'duplicate column name' not in str(e):
+                    raise
+
+    suffix = str(int(time.time() * 1000))
+    results = execute_batch([
+        ('INSERT INTO users (name, email, password_hash, role) VALUES (?, ?, ?, ?) RETURNING id',
+         ['Stress Test', f'stress-{suffix}@test.local', '-', 'user']),
+    ])
+    user_id = results[0].rows[0]['id']
+
+    challenge_ids = []
+    for equity in (START_BALANCE, START_BALANCE * 1.1 - TARGET_HEADROOM):
+        result = execute_query(
+            'INSERT INTO challenges (user_id, plan_id, start_balance, current_equity, status) VALUES (?, ?, ?, ?, ?) RETURNING id',
+            [user_id, 1, START_BALANCE, equity, 'active']
+        )
+        challenge_ids.append((result.rows[0]['id'], equity))
+
+    return user_id, challenge_ids
+
+def run_test():
+    api_dir = os.path.dirname(os.path.abspath(__file__))
+    if api_dir not in sys.path:
+        sys.path.insert(0, api_dir)
+
+    user_id, challenges = setup_database()
+
+    from db import fetch_one
+    from services.challenge_engine import ChallengeEngine, COMMISSION_RATE
+
+    # Half of the jobs go through the single-batch order path, the other half
+    # apply P&L directly; both race the rule check's versioned status write.
+    jobs = []
+    for challenge_id, _ in challenges:
+        for i in range(ORDERS_PER_CHALLENGE):
+            if i % 2 == 0:
+                jobs.append(('order', challenge_id, 'buy' if i % 4 == 0 else 'sell'))
+            else:
+                jobs.append(('pnl', challenge_id, PNL_STEP if i % 4 == 1 else -PNL_STEP / 2))
+
+    def run_job(job):
+        kind, challenge_id, arg = job
+        if kind == 'order':
+            result, error = ChallengeEngine.execute_order(challenge_id, str(user_id), 'AAPL', arg, 1, PRICE)
+            # An order placed after the challenge passed is rejected, not lost
+            if error and error[1] != 400:
+                raise RuntimeError(error[0])
+            return error is None
+        ChallengeEngine.calculate_trade_impact(challenge_id, arg)
+        return True
+
+    print(f"Firing {len(jobs)} orders with {THREADS} threads...")
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=THREADS) as pool:
+        accepted = list(pool.map(run_job, jobs))
+    elapsed = time.perf_counter() - started
+    print(f"⏱  {len(jobs)} orders in {elapsed:.2f}s ({len(jobs) / elapsed:.0f} orders/s)")
+
+    # Expected equity per challenge from the accepted jobs
+    failures = 0
+    for challenge_id, start_equity in challenges:
+        expected = start_equity
+        orders = 0
+        for (kind, job_challenge_id, arg), ok in zip(jobs, accepted):
+            if job_challenge_id != challenge_id or not ok:
+                continue
+            if kind == 'order':
+                expected -= PRICE * COMMISSION_RATE
+                orders += 1
+            else:
+                expected += arg
+
+        row = fetch_one(
+            'SELECT current_equity, status, version, '
+            '(SELECT COUNT(*) FROM trades t WHERE t.challenge_id = challenges.id) AS trade_count '
+            'FROM challenges WHERE id = ?', [challenge_id]
+        )
+        actual = float(row['current_equity'])
+        ok = abs(actual - expected) < 1e-6 and row['trade_count'] == orders
+        failures += 0 if ok else 1
+        print(f"{'✅' if ok else '❌'} Challenge {challenge_id}: equity {actual:.4f} (expected {expected:.4f}), "
+              f"{row['trade_count']} trades (expected {orders}), status {row['status']}, version {row['version']}")
+
+    if failures:
+        print("\n❌ Lost updates detected!")
+        exit(1)
+    print("\n✅ No lost updates")
+
+if __name__ == "__main__":
+    run_test()
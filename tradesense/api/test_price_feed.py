@@ -0,0 +1,134 @@
+"""
+Price feed test
+Streams /stream to two clients from a PriceFeed over a FakeUpstream and
+checks that quote events arrive in publish order, that each client only
+gets its own symbols, and that disconnecting removes the subscription.
+
+Needs no network or database: prices come from FakeUpstream and the feed
+is polled by hand.
+"""
+import json
+import os
+import queue
+import sys
+import threading
+import time
+
+def parse_event(message):
+    """SSE message as (event, data)"""
+    fields = dict(line.split(': ', 1) for line in message.strip().split('\n'))
+    if 'event' in fields:
+        return fields['event'], json.loads(fields['data'])
+    return 'retry', fields.get('retry')
+
+def listen(client, symbols, events, disconnect):
+    """
+    One streaming client: puts every event of /stream on events until
+    disconnect is set. Runs on its own thread, as each client does on the
+    server.
+    """
+    response = client.get(f'/api/market/stream?symbols={symbols}', buffered=False)
+    try:
+        for chunk in response.iter_encoded():
+            if disconnect.is_set():
+                break
+            message = chunk.decode()
+            if not message.startswith(':'):  # keepalive
+                events.put(parse_event(message))
+    finally:
+        response.close()
+
+def connect(client, symbols):
+    events, disconnect = queue.Queue(), threading.Event()
+    thread = threading.Thread(target=listen, args=(client, symbols, events, disconnect), daemon=True)
+    thread.start()
+    return events, disconnect, thread
+
+def read_quotes(events, count):
+    quotes = []
+    for _ in range(count):
+        event, data = events.get(timeout=5)
+        if event != 'quote':
+            raise AssertionError(f"Expected a quote event, got {event}")
+        quotes.append((data['symbol'], data['price']))
+    return quotes
+
+def run_test():
+    api_dir = os.path.dirname(os.path.abspath(__file__))
+    if api_dir not in sys.path:
+        sys.path.insert(0, api_dir)
+
+    from flask import Flask
+    import routes.market as market
+    from services.price_feed import PriceFeed, FakeUpstream
+
+    upstream = FakeUpstream({'AAA': 10, 'BBB': 20})
+    # Polled by hand below; the poller thread only runs its first poll
+    feed = PriceFeed(upstream, interval=3600)
+    market.price_feed = feed
+    # Keepalives every 50ms let a client notice its disconnect quickly
+    market.STREAM_KEEPALIVE_SECONDS = 0.05
+
+    app = Flask(__name__)
+    app.register_blueprint(market.market_bp, url_prefix='/api/market')
+    client = app.test_client()
+
+    failures = 0
+    def check(ok, message):
+        nonlocal failures
+        failures += 0 if ok else 1
+        print(f"{'✅' if ok else '❌'} {message}")
+
+    # Client A subscribes; the poller's first poll publishes both prices
+    events_a, disconnect_a, thread_a = connect(client, 'AAA,BBB')
+    check(events_a.get(timeout=5) == ('retry', '3000'), "A: retry interval comes first")
+    check(sorted(read_quotes(events_a, 2)) == [('AAA', 10.0), ('BBB', 20.0)], "A: initial prices")
+
+    # Client B joins later and starts with the last published BBB price
+    events_b, disconnect_b, thread_b = connect(client, 'BBB')
+    check(events_b.get(timeout=5) == ('retry', '3000'), "B: retry interval comes first")
+    check(read_quotes(events_b, 1) == [('BBB', 20.0)], "B: starts with the latest price")
+    check(feed.symbols() == {'AAA', 'BBB'}, "Feed polls the union of both clients' symbols")
+
+    upstream.set_price('AAA', 11)
+    upstream.set_price('BBB', 21)
+    feed.poll_once()
+    upstream.set_price('BBB', 22)
+    feed.poll_once()
+    check(not feed.poll_once(), "Unchanged prices publish nothing")
+
+    # Within one poll the order is unspecified, across polls it is kept
+    quotes_a = read_quotes(events_a, 3)
+    check(sorted(quotes_a[:2]) == [('AAA', 11.0), ('BBB', 21.0)] and quotes_a[2] == ('BBB', 22.0),
+          f"A: updates in publish order {quotes_a}")
+    quotes_b = read_quotes(events_b, 2)
+    check(quotes_b == [('BBB', 21.0), ('BBB', 22.0)], f"B: only BBB, in publish order {quotes_b}")
+
+    # Disconnecting closes the stream generator, which unsubscribes
+    disconnect_a.set()
+    thread_a.join(timeout=5)
+    check(not thread_a.is_alive() and feed.symbols() == {'BBB'}, "A's symbols are dropped when A disconnects")
+    upstream.set_price('AAA', 12)
+    upstream.set_price('BBB', 23)
+    feed.poll_once()
+    check(upstream.calls[-1] == ['BBB'], "Upstream is only asked for the remaining symbols")
+    check(read_quotes(events_b, 1) == [('BBB', 23.0)], "B keeps streaming")
+    check(events_a.empty(), "A gets nothing after disconnecting")
+
+    disconnect_b.set()
+    thread_b.join(timeout=5)
+    check(not feed.symbols() and not feed._subscriptions, "No subscriptions left after both disconnect")
+    calls = len(upstream.calls)
+    feed.poll_once()
+    check(len(upstream.calls) == calls, "An idle feed does not call upstream")
+    feed.stop()
+
+    if failures:
+        print(f"\n❌ {failures} check(s) failed")
+        exit(1)
+    print("\n✅ Price feed OK")
+
+if __name__ == "__main__":
+    started = time.perf_counter()
+    run_test()
+    print(f"⏱  {time.perf_counter() - started:.2f}s")
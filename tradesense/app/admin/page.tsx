@@ -5,12 +5,14 @@ import api from '@/lib/api';
 
 export default function AdminPage() {
     const [challenges, setChallenges] = useState<any[]>([]);
+    const [nextCursor, setNextCursor] = useState<string | null>(null);
     const [authError, setAuthError] = useState(false);
 
     const fetchAll = async () => {
         try {
             const res = await api.get('/admin/challenges');
             setChallenges(res.data.challenges);
+            setNextCursor(res.data.next_cursor);
             setAuthError(false);
         } catch (err) {
             console.error(err);
@@ -18,6 +20,17 @@ export default function AdminPage() {
         }
     };
 
+    const loadMore = async () => {
+        if (!nextCursor) return;
+        try {
+            const res = await api.get('/admin/challenges', { params: { cursor: nextCursor } });
+            setChallenges(prev => [...prev, ...res.data.challenges]);
+            setNextCursor(res.data.next_cursor);
+        } catch (err) {
+            console.error(err);
+        }
+    };
+
     useEffect(() => {
         fetchAll();
     }, []);
@@ -90,6 +103,11 @@ export default function AdminPage() {
                         ))}
                     </tbody>
                 </table>
+                {nextCursor && (
+                    <button onClick={loadMore} className="w-full p-3 text-sm text-slate-400 hover:bg-white/5 border-t border-slate-800">
+                        Load more
+                    </button>
+                )}
             </div>
         </div>
     );